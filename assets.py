@@ -0,0 +1,180 @@
+from pygame import Surface
+from typing import Dict, List
+from collections import deque
+import pygame, threading, itertools
+
+class Asset:
+    '''A handle to an image owned by an AssetManager. Acquiring it from the manager takes a reference, which keeps
+    it from being evicted until it is released. Its pixels are decoded on the manager's loader thread if it
+    was queued in time, otherwise on the first call to get.'''
+    UNLOADED = 0
+    QUEUED = 1
+    LOADING = 2
+    LOADED = 3
+    FAILED = 4
+
+    def __init__(self, manager : "AssetManager", path : str):
+        self.manager = manager
+        self.path = path
+        self.state = Asset.UNLOADED
+        self.ref_count = 0
+        self.last_used = 0
+        #Bytes of pixel data held, counted against the manager's budget once loaded
+        self.size = 0
+        self.decoded : Surface = None
+        self.surface : Surface = None
+        self.is_ready = threading.Event()
+
+    def get(self) -> Surface:
+        '''Returns the image, decoding it now if it has not been already. Returns None if it could not be loaded.'''
+        self.last_used = next(self.manager.ticks)
+        if self.state != Asset.LOADED and self.state != Asset.FAILED:
+            self.manager.load_now(self)
+        if self.surface == None and self.decoded != None:
+            #Converting needs a display, which headless runs do not have
+            self.surface = self.decoded if pygame.display.get_surface() == None else self.decoded.convert_alpha()
+            self.decoded = None
+        return self.surface
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.state == Asset.LOADED
+
+    def release(self):
+        self.manager.release(self)
+
+class AssetManager:
+    '''Loads images once and shares them between everything using them. Decoding happens on a loader thread
+    for anything queued with preload, so it does not stall the frame that first needs it. Assets nothing
+    holds a reference to are kept around until the total size of loaded assets goes over memory_budget,
+    then the least recently used ones are dropped.'''
+    shared : "AssetManager" = None
+
+    def __init__(self, memory_budget : int = 64 * 1024 * 1024):
+        self.memory_budget = memory_budget
+        self.assets : Dict[str, Asset] = {}
+        self.total_size = 0
+        self.ticks = itertools.count(1)
+        #Guards asset states, the queue and total_size between the loader thread and the main thread
+        self.lock = threading.Lock()
+        self.has_work = threading.Condition(self.lock)
+        self.queue : deque = deque()
+        self.thread : threading.Thread = None
+
+    def get_surface_bytes(surface : Surface) -> int:
+        '''Returns the bytes of pixel data a surface holds. Subsurfaces share their parent's pixels, so they hold none.'''
+        if surface == None or surface.get_parent() != None:
+            return 0
+        return surface.get_pitch() * surface.get_height()
+
+    def get_memory_usage(self) -> int:
+        '''Returns the bytes held by every loaded asset.'''
+        return sum(AssetManager.get_surface_bytes(asset.surface if asset.surface != None else asset.decoded)
+                   for asset in list(self.assets.values()) if asset.state == Asset.LOADED)
+
+    def get_asset(self, path : str) -> Asset:
+        asset = self.assets.get(path)
+        if asset == None:
+            asset = Asset(self, path)
+            self.assets[path] = asset
+        return asset
+
+    def acquire(self, path : str) -> Asset:
+        '''Returns the asset for a path with a reference taken on it, queueing it to load if it is not loaded.'''
+        asset = self.get_asset(path)
+        asset.ref_count += 1
+        asset.last_used = next(self.ticks)
+        self.queue_load(asset)
+        return asset
+
+    def release(self, asset : Asset):
+        '''Gives up a reference taken by acquire. Unreferenced assets stay loaded until the budget needs the room.'''
+        if asset.ref_count <= 0:
+            return
+        asset.ref_count -= 1
+        if asset.ref_count == 0:
+            self.evict()
+
+    def preload(self, paths : List[str]):
+        '''Queues images to be decoded in the background without taking references to them, for areas that are about to be needed.'''
+        for path in paths:
+            self.queue_load(self.get_asset(path))
+
+    def queue_load(self, asset : Asset):
+        with self.lock:
+            if asset.state != Asset.UNLOADED:
+                return
+            asset.state = Asset.QUEUED
+            asset.is_ready.clear()
+            self.queue.append(asset)
+            self.has_work.notify()
+        if self.thread == None:
+            self.thread = threading.Thread(target=self.run, name="AssetLoader", daemon=True)
+            self.thread.start()
+
+    def load_now(self, asset : Asset):
+        '''Makes sure an asset is loaded before returning. Anything not yet picked up by the loader thread is decoded
+        here instead of waiting behind the rest of the queue.'''
+        with self.lock:
+            if asset.state == Asset.UNLOADED or asset.state == Asset.QUEUED:
+                asset.state = Asset.LOADING
+                asset.is_ready.clear()
+                is_loading_here = True
+            else:
+                is_loading_here = False
+        if is_loading_here:
+            self.decode(asset)
+        else:
+            asset.is_ready.wait()
+        #The asset is about to be used, so it is kept even if nothing holds a reference to it
+        self.evict(asset)
+
+    def decode(self, asset : Asset):
+        try:
+            decoded = pygame.image.load(asset.path)
+        except (pygame.error, OSError):
+            print("Err loading image from path: " + asset.path)
+            decoded = None
+        with self.lock:
+            asset.decoded = decoded
+            asset.surface = None
+            if decoded == None:
+                asset.state = Asset.FAILED
+            else:
+                asset.state = Asset.LOADED
+                #Images are converted to 32 bits per pixel when first used
+                asset.size = decoded.get_width() * decoded.get_height() * 4
+                self.total_size += asset.size
+        asset.is_ready.set()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while len(self.queue) == 0:
+                    self.has_work.wait()
+                asset : Asset = self.queue.popleft()
+                #It may have been loaded on the main thread while it waited in the queue
+                if asset.state != Asset.QUEUED:
+                    continue
+                asset.state = Asset.LOADING
+            #pygame lets go of the GIL while decoding, so this runs alongside the main thread
+            self.decode(asset)
+
+    def evict(self, keep : Asset = None):
+        '''Drops the least recently used unreferenced assets until the loaded ones fit in the memory budget,
+        other than keep.'''
+        with self.lock:
+            if self.total_size <= self.memory_budget:
+                return
+            unused = [asset for asset in self.assets.values() if asset.ref_count == 0 and asset.state == Asset.LOADED and asset is not keep]
+            unused.sort(key=lambda asset: asset.last_used)
+            for asset in unused:
+                if self.total_size <= self.memory_budget:
+                    break
+                asset.decoded = None
+                asset.surface = None
+                asset.state = Asset.UNLOADED
+                self.total_size -= asset.size
+                asset.size = 0
+
+AssetManager.shared = AssetManager()
@@ -0,0 +1,279 @@
+"""Benchmarks for the hot paths of the engine. Each case is set up at a scale and timed over a number of
+repeats, the results can be written to json and compared against a stored baseline, for example:
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline benchmark_baseline.json --tolerance 0.25
+    python benchmark.py --baseline benchmark_baseline.json --update-baseline
+
+Timings only mean something next to ones taken on the same machine, so every json file records the machine
+it was written on. The benchmark_baseline.json kept with the project was recorded on the machine noted in it, a
+machine that differs should record its own baseline with --update-baseline before comparing against it."""
+
+import os, sys, time, json, random, argparse, statistics, platform
+#Everything runs without a window, this has to be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+from typing import Callable, Dict, List, Tuple
+from tilemap import Tilemap
+from entity import Collider, RectCollider, CircleCollider, Entity
+from vector import Vector2
+from sprite import Sprite, AnimationSystem
+from camera import Camera
+from particles import ParticleSystem
+
+SCREEN_SIZE = (640, 360)
+
+def get_tile_ids(has_collision : bool) -> List[int]:
+    return [id for id, tile_type in sorted(Tilemap.tile_types.items()) if tile_type.has_collision == has_collision]
+
+def fill_tilemap(tilemap : Tilemap, size : int, tile_ids : List[int], wall_spacing : int = 0):
+    '''Fills a size by size square with the given tile ids in turn, with a wall every wall_spacing tiles if it is set.'''
+    wall = get_tile_ids(True)[0]
+    for x in range(size):
+        for y in range(size):
+            id = tile_ids[(x + y) % len(tile_ids)]
+            if wall_spacing > 0 and x % wall_spacing == 0 and y % wall_spacing == 0:
+                id = wall
+            tilemap.set_tile(Vector2(x, y), id)
+
+#Every case takes a scale and returns the function to time, it is set up again before each repeat
+def bench_set_tile_bulk(scale : int) -> Callable[[], None]:
+    '''Fills an empty tilemap, 32 by 32 tiles at scale 1.'''
+    size = 32 * scale
+    tilemap = Tilemap()
+    tile_ids = get_tile_ids(False)[:1]
+    return lambda: fill_tilemap(tilemap, size, tile_ids)
+
+def bench_set_tile_single(scale : int) -> Callable[[], None]:
+    '''Places and removes a wall in the middle of a filled tilemap 10 times, this is the latency of one edit.'''
+    size = 32 * scale
+    tilemap = Tilemap()
+    floor = get_tile_ids(False)[0]
+    wall = get_tile_ids(True)[0]
+    fill_tilemap(tilemap, size, [floor])
+    center = Vector2(size // 2, size // 2)
+    def run():
+        for i in range(10):
+            tilemap.set_tile(center, wall if i % 2 == 0 else floor)
+    return run
+
+def bench_update_chunks(scale : int) -> Callable[[], None]:
+    '''Rebuilds every chunk of a tilemap using scale different tile types, floors and walls alike.'''
+    tilemap = Tilemap()
+    tile_ids = sorted(Tilemap.tile_types.keys())[:max(1, scale)]
+    fill_tilemap(tilemap, 32, tile_ids)
+    def run():
+        for chunk_pos, chunk in tilemap.floor_chunks.items():
+            tilemap.update_chunk(chunk_pos, chunk)
+        for chunk_pos, chunk in tilemap.wall_chunks.items():
+            tilemap.update_wall_chunk(chunk_pos, chunk)
+    return run
+
+def bench_bake_chunks(scale : int) -> Callable[[], None]:
+    '''Bakes every chunk of a tilemap 32 by 32 tiles at scale 1.'''
+    tilemap = Tilemap()
+    fill_tilemap(tilemap, 32 * scale, sorted(Tilemap.tile_types.keys()))
+    def run():
+        for chunk in list(tilemap.floor_chunks.values()) + list(tilemap.wall_chunks.values()):
+            chunk.bake()
+    return run
+
+def bench_move_and_collide(scale : int) -> Callable[[], None]:
+    '''Moves an entity for 60 steps through a room of pillars with 16 other colliders in it at scale 1.'''
+    random.seed(scale)
+    Collider.colliders.clear()
+    tilemap = Tilemap()
+    fill_tilemap(tilemap, 32, get_tile_ids(False)[:1], 3)
+    for i in range(16 * scale):
+        Collider.add(CircleCollider(random.uniform(0, 512), random.uniform(0, 512), 24, False, False))
+    entity = Entity(40, 40, RectCollider(8, 24, 16, 8, False, False))
+    def run():
+        for i in range(60):
+            #Change direction every 15 steps so it keeps running into things
+            direction = (i // 15) % 4
+            entity.velocity = Vector2((1, 0, -1, 0)[direction], (0, 1, 0, -1)[direction]) * 160
+            entity.move_and_collide(1 / 60, tilemap)
+    return run
+
+def bench_slide_along_wall(scale : int) -> Callable[[], None]:
+    '''Slides an entity along a wall 3 tiles thick for 60 steps at scale 1, pressing into it as it goes.'''
+    Collider.colliders.clear()
+    tilemap = Tilemap()
+    fill_tilemap(tilemap, 32, get_tile_ids(False)[:1])
+    wall = get_tile_ids(True)[0]
+    for x in range(-16, 64 * scale):
+        for y in range(10, 13):
+            tilemap.set_tile(Vector2(x, y), wall)
+    #The bottom of its collider starts just touching the top of the wall
+    entity = Entity(0, 128, RectCollider(8, 24, 16, 8, False, False))
+    def run():
+        for i in range(60 * scale):
+            entity.velocity = Vector2(1, 0.5) * 160
+            entity.move_and_collide(1 / 60, tilemap)
+    return run
+
+def bench_camera_draw(scale : int) -> Callable[[], None]:
+    '''Draws 256 sorted drawables at scale 1 for 10 frames, with a quarter of them moving every frame.'''
+    random.seed(scale)
+    screen = pygame.display.get_surface()
+    camera = Camera(0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1])
+    surface = pygame.Surface((16, 32), pygame.SRCALPHA).convert_alpha()
+    surface.fill((200, 100, 50, 200))
+    drawables = [camera.add_retained(Camera.SORTED, surface, random.uniform(0, 624), random.uniform(0, 328), 32)
+                 for i in range(256 * scale)]
+    def run():
+        for frame in range(10):
+            for drawable in drawables[frame % 4::4]:
+                drawable.set_position(random.uniform(0, 624), random.uniform(0, 328))
+            screen.fill((0, 0, 0))
+            camera.draw(screen)
+    return run
+
+def bench_sprite_draw(scale : int) -> Callable[[], None]:
+    '''Animates and draws 64 flipped sprites at scale 1 for 10 frames.'''
+    random.seed(scale)
+    screen = pygame.display.get_surface()
+    camera = Camera(0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1])
+    animation_system = AnimationSystem()
+    sprites : List[Sprite] = []
+    for i in range(64 * scale):
+        sprite = Sprite(random.uniform(0, 608), random.uniform(0, 296), 48)
+        if "KarenWalk" not in Sprite.animations:
+            sprite.add_animation("KarenWalk", "Images/KarenWalk.png", 32, 64, 12, 12, True)
+        sprite.flip_x = True
+        sprite.play("KarenWalk")
+        animation_system.add(sprite)
+        sprites.append(sprite)
+    def run():
+        for frame in range(10):
+            animation_system.update(1 / 60)
+            for sprite in sprites:
+                sprite.draw(camera)
+            screen.fill((0, 0, 0))
+            camera.draw(screen)
+    return run
+
+def bench_particles(scale : int) -> Callable[[], None]:
+    '''Updates and draws 5000 particles at scale 1 for 10 frames, bouncing around a room of pillars.'''
+    screen = pygame.display.get_surface()
+    camera = Camera(0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1])
+    tilemap = Tilemap()
+    fill_tilemap(tilemap, 40, get_tile_ids(False)[:1], 3)
+    particles = ParticleSystem(ParticleSystem.make_dot_frames((255, 220, 120), 2, 4), tilemap=tilemap, seed=scale)
+    particles.gravity = (0, 200)
+    particles.emit(320, 180, 5000 * scale, (50, 200), (100, 100), radius=150)
+    def run():
+        for frame in range(10):
+            particles.update(1 / 60)
+            particles.draw(camera)
+            screen.fill((0, 0, 0))
+            camera.draw(screen)
+    return run
+
+def bench_overview(scale : int) -> Callable[[], None]:
+    '''Draws a map 64 by 64 tiles at scale 1 zoomed out to an eighth for 10 frames, scrolling across it.'''
+    screen = pygame.display.get_surface()
+    camera = Camera(0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1])
+    camera.set_zoom(1 / 8)
+    tilemap = Tilemap()
+    fill_tilemap(tilemap, 64 * scale, get_tile_ids(False)[:2], 3)
+    #Every level is made on the first frame drawn, this times drawing from them
+    tilemap.draw(camera)
+    camera.draw(screen)
+    def run():
+        for frame in range(10):
+            camera.set_position(Vector2(frame * 32, frame * 16))
+            tilemap.draw(camera)
+            screen.fill((0, 0, 0))
+            camera.draw(screen)
+    return run
+
+CASES : Dict[str, Tuple[Callable[[int], Callable[[], None]], List[int]]] = {
+    "set_tile_bulk" : (bench_set_tile_bulk, [1, 2, 4]),
+    "set_tile_single" : (bench_set_tile_single, [1, 4]),
+    "update_chunks" : (bench_update_chunks, [1, 2, 3, 4, 5]),
+    "bake_chunks" : (bench_bake_chunks, [1, 2]),
+    "move_and_collide" : (bench_move_and_collide, [1, 4, 16]),
+    "slide_along_wall" : (bench_slide_along_wall, [1, 4]),
+    "camera_draw" : (bench_camera_draw, [1, 4, 16]),
+    "sprite_draw" : (bench_sprite_draw, [1, 4, 16]),
+    "particles" : (bench_particles, [1, 4]),
+    "overview" : (bench_overview, [1, 2]),
+}
+
+def run_case(setup : Callable[[int], Callable[[], None]], scale : int, repeat : int) -> Dict[str, float]:
+    '''Times a case at a scale, returning the median and fastest of the repeats in milliseconds.'''
+    times : List[float] = []
+    for i in range(repeat):
+        run = setup(scale)
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms" : statistics.median(times), "min_ms" : min(times), "repeat" : repeat}
+
+def get_machine() -> Dict[str, str]:
+    '''Describes the machine and versions results are being recorded with.'''
+    return {"platform" : platform.platform(), "processor" : platform.processor() or platform.machine(),
+            "cpu_count" : str(os.cpu_count()), "python" : platform.python_version(), "pygame" : pygame.version.ver}
+
+def compare(results : Dict, baseline : Dict, tolerance : float) -> List[str]:
+    '''Returns a line for every result that is slower than its baseline by more than tolerance. The fastest
+    repeats are compared, as they are the least thrown off by whatever else the machine is doing.'''
+    failures : List[str] = []
+    for name, scales in results.items():
+        for scale, result in scales.items():
+            expected = baseline.get(name, {}).get(scale)
+            if expected == None:
+                continue
+            budget = expected["min_ms"] * (1 + tolerance)
+            if result["min_ms"] > budget:
+                failures.append("%s at scale %s took %.3f ms, over its budget of %.3f ms" % (name, scale, result["min_ms"], budget))
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imora benchmarks")
+    parser.add_argument("--cases", nargs="*", default=list(CASES.keys()), help="names of the cases to run, all of them by default")
+    parser.add_argument("--scales", nargs="*", type=int, default=None, help="scales to run every case at, instead of each case's own")
+    parser.add_argument("--repeat", type=int, default=5, help="times to run each case at each scale")
+    parser.add_argument("--output", type=str, default="", help="file to write the results to as json")
+    parser.add_argument("--baseline", type=str, default="", help="json results to compare against, exits with 1 if a case is over budget")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="how much slower than the baseline a case can be, 0.25 is 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to the baseline file instead of comparing")
+    args = parser.parse_args()
+
+    #Assets are loaded relative to the project
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pygame.init()
+    pygame.display.set_mode(SCREEN_SIZE)
+
+    results : Dict[str, Dict[str, Dict[str, float]]] = {}
+    for name in args.cases:
+        if name not in CASES:
+            print("Unknown case: " + name)
+            sys.exit(2)
+        setup, scales = CASES[name]
+        results[name] = {}
+        for scale in (args.scales if args.scales != None else scales):
+            result = run_case(setup, scale, args.repeat)
+            #Keys are strings so they survive a round trip through json
+            results[name][str(scale)] = result
+            print("%-18s scale %3d  median %9.3f ms  min %9.3f ms" % (name, scale, result["median_ms"], result["min_ms"]))
+
+    #Saved next to the cases, which never share its name
+    saved = dict(results, machine=get_machine())
+    if args.output != "":
+        with open(args.output, "w") as file:
+            json.dump(saved, file, indent=4)
+    if args.baseline != "":
+        if args.update_baseline:
+            with open(args.baseline, "w") as file:
+                json.dump(saved, file, indent=4)
+        else:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+            if baseline.get("machine") != saved["machine"]:
+                print("The baseline was recorded on another machine, or with other versions: " + json.dumps(baseline.get("machine")))
+            failures = compare(results, baseline, args.tolerance)
+            for failure in failures:
+                print(failure)
+            sys.exit(1 if len(failures) > 0 else 0)
@@ -1,59 +1,478 @@
-from pygame import Surface
-from typing import List
+from pygame import Surface, Rect, transform
+from typing import List, Dict, Tuple, Set
 from vector import Vector2
-import math
+from operator import attrgetter
+from profiler import Profiler
+import math, bisect, weakref
 
 class Drawable:
+    '''A surface at a position on one of the camera's layers. Drawables added with add_to_* only last a frame,
+    ones returned by Camera.add_retained stay on the camera until removed and should be changed with the set_* methods.'''
+    __slots__ = ("surface", "x", "y", "y_offset", "sort_key", "order_key", "is_visible", "camera", "layer")
+
     def __init__(self, surface : Surface, x : float, y : float, y_offset : float):
         self.surface = surface
         self.x = math.floor(x)
         self.y = math.floor(y)
         self.y_offset = math.floor(y_offset)
+        #Depth of the drawable on the sorted layer, kept up to date so sorting never computes it
+        self.sort_key : int = self.y + self.y_offset
+        #The sort key the drawable was last placed in its camera's sorted order with
+        self.order_key : int = self.sort_key
+        self.is_visible = True
+        self.camera : Camera = None
+        self.layer = -1
+
+    def set_position(self, x : float, y : float):
+        x = math.floor(x)
+        y = math.floor(y)
+        if x == self.x and y == self.y:
+            return
+        self.x = x
+        self.y = y
+        self.update_sort_key()
+        self.mark_dirty()
+
+    def set_surface(self, surface : Surface):
+        if surface is self.surface:
+            return
+        self.surface = surface
+        self.mark_dirty()
+
+    def set_y_offset(self, y_offset : float):
+        y_offset = math.floor(y_offset)
+        if y_offset == self.y_offset:
+            return
+        self.y_offset = y_offset
+        self.update_sort_key()
+        self.mark_dirty()
+
+    def set_visible(self, is_visible : bool):
+        if is_visible == self.is_visible:
+            return
+        self.is_visible = is_visible
+        self.mark_dirty()
+
+    def update_sort_key(self):
+        sort_key = self.y + self.y_offset
+        if sort_key == self.sort_key:
+            return
+        self.sort_key = sort_key
+        if self.camera != None and self.layer == Camera.SORTED:
+            self.camera.unordered[self] = None
+
+    def mark_dirty(self):
+        if self.camera != None:
+            self.camera.dirty_layers[self.layer] = True
+
+    def remove(self):
+        if self.camera != None:
+            self.camera.remove_retained(self)
 
 class Camera:
-    def __init__(self, x : float, y : float):
+    UNSORTED = 0
+    SORTED = 1
+    CEILING = 2
+    OVERLAY = 3
+    #Each zoom level draws everything at half the size of the one before, down to an eighth
+    MAX_LEVEL = 3
+
+    def __init__(self, x : float, y : float, width : int = 640, height : int = 360):
         self.x : int = math.floor(x)
         self.y : int = math.floor(y)
+        self.width = width
+        self.height = height
+        #How far the camera is zoomed out, see set_zoom
+        self.level = 0
+        #Copies of surfaces scaled down to the current level by the surface they were made from, see get_scaled
+        self.scaled_surfaces : weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
         self.drawables : List[Drawable] = []
         self.sorted_drawables : List[Drawable] = []
         self.ceilings : List[Drawable] = []
         self.overlays : List[Drawable] = []
-    
+        #Blits added in bulk for a frame by layer, see add_batch
+        self.batches : List[List[Tuple[Surface, Tuple[int, int]]]] = [[], [], [], []]
+        self.batch_size = 0
+        self.has_batches = False
+        #Blits in screen space drawn over everything for a frame, see add_to_screen
+        self.screen_blits : List[Tuple[Surface, Tuple[int, int]]] = []
+
+        #Retained drawables by layer, dicts are used as ordered sets so removal is cheap
+        self.retained : List[Dict[Drawable, None]] = [{}, {}, {}, {}]
+        #The visible retained drawables of each layer and their blits, only rebuilt when the layer changes or the camera moves
+        self.visible_retained : List[List[Drawable]] = [[], [], [], []]
+        self.retained_blits : List[List[Tuple[Surface, Tuple[int, int]]]] = [[], [], [], []]
+        self.dirty_layers : List[bool] = [True, True, True, True]
+        self.cached_position : Tuple[int, int] = None
+        #Every retained sorted drawable by depth. It persists between frames, so only the drawables in
+        #unordered (new ones, or ones whose sort key changed) need to be moved back into place.
+        self.sorted_order : List[Drawable] = []
+        self.ordered : Set[Drawable] = set()
+        self.unordered : Dict[Drawable, None] = {}
+
+        #Dirty rect drawing, see draw_dirty
+        self.background_color = (0, 0, 0)
+        self.previous_frame : Dict[Tuple[Surface, Tuple[int, int]], Rect] = {}
+        self.invalid_rects : List[Rect] = []
+        self.full_redraw = True
+        self.dirty_position : Tuple[int, int] = None
+        self.dirty_size : Tuple[int, int] = None
+
+        #A canvas at the camera's own resolution and how it was last scaled onto the window, see present
+        self.canvas : Surface = None
+        self.present_scale = 1
+        self.present_rect : Rect = None
+        self.present_target : Surface = None
+
     def screen_to_world(self, vector : Vector2):
-        return vector + Vector2(self.x, self.y)
+        return vector * (1 << self.level) + Vector2(self.x, self.y)
+
+    def window_to_screen(self, vector : Vector2) -> Vector2:
+        '''Converts a position in the window to one on the canvas, undoing the scaling done by present.'''
+        if self.present_rect == None:
+            return Vector2(vector.x, vector.y)
+        return Vector2((vector.x - self.present_rect.x) // self.present_scale, (vector.y - self.present_rect.y) // self.present_scale)
 
     def set_position(self, new_position : Vector2):
         self.x = math.floor(new_position.x)
         self.y = math.floor(new_position.y)
 
+    @property
+    def zoom(self) -> float:
+        return 1 / (1 << self.level)
+
+    @property
+    def view_width(self) -> int:
+        '''The width of the world the camera sees, which is wider than the camera when zoomed out.'''
+        return self.width << self.level
+
+    @property
+    def view_height(self) -> int:
+        return self.height << self.level
+
+    def set_zoom(self, zoom : float):
+        '''Sets how large things are drawn, 1 is the art's own size and 0.5 is half of it. The zoom is rounded to the
+        nearest level, a power of two no smaller than 1 / 2 ** MAX_LEVEL, so surfaces only ever have to be halved to fit.'''
+        level = min(Camera.MAX_LEVEL, max(0, round(-math.log2(zoom))))
+        if level == self.level:
+            return
+        self.level = level
+        self.scaled_surfaces = weakref.WeakKeyDictionary()
+        self.full_redraw = True
+
+    def downsample(surface : Surface) -> Surface:
+        '''Returns a copy of a surface at half its size, with each pixel averaged from the ones it covers.'''
+        size = (max(1, (surface.get_width() + 1) // 2), max(1, (surface.get_height() + 1) // 2))
+        Profiler.shared.count("surfaces")
+        #Smooth scaling only works on 24 and 32 bit surfaces
+        if surface.get_bitsize() < 24:
+            return transform.scale(surface, size)
+        return transform.smoothscale(surface, size)
+
+    def get_scaled(self, surface : Surface) -> Surface:
+        '''Returns a surface scaled down to the camera's level. A copy is made the first time a surface is drawn at
+        a level and kept for as long as the surface is, unless one was handed over beforehand with set_scaled.'''
+        scaled = self.scaled_surfaces.get(surface)
+        if scaled == None:
+            scaled = surface
+            for level in range(self.level):
+                scaled = Camera.downsample(scaled)
+            self.scaled_surfaces[surface] = scaled
+        return scaled
+
+    def set_scaled(self, surface : Surface, scaled : Surface):
+        '''Has the camera draw scaled in place of surface at its current level, for surfaces that keep their own
+        scaled down copies. It has to be called again whenever surface is drawn onto in place.'''
+        self.scaled_surfaces[surface] = scaled
+
+    def is_rect_visible(self, x : float, y : float, width : float, height : float) -> bool:
+        '''Returns whether a rect in world space overlaps the camera's view.'''
+        return (x < self.x + (self.width << self.level) and x + width > self.x and
+                y < self.y + (self.height << self.level) and y + height > self.y)
+
+    def is_visible(self, surface : Surface, x : float, y : float) -> bool:
+        '''Returns whether a surface drawn at a world position would overlap the camera's view.'''
+        width, height = surface.get_size()
+        return self.is_rect_visible(x, y, width, height)
+
+    def add_retained(self, layer : int, surface : Surface, x : float, y : float, y_offset : float = 0) -> Drawable:
+        '''Adds a drawable that is drawn every frame until it is removed. Culling happens when the camera draws.'''
+        drawable = Drawable(surface, x, y, y_offset)
+        drawable.camera = self
+        drawable.layer = layer
+        self.retained[layer][drawable] = None
+        self.dirty_layers[layer] = True
+        if layer == Camera.SORTED:
+            self.unordered[drawable] = None
+        return drawable
+
+    def remove_retained(self, drawable : Drawable):
+        if drawable.camera is not self:
+            return
+        self.retained[drawable.layer].pop(drawable, None)
+        self.dirty_layers[drawable.layer] = True
+        if drawable.layer == Camera.SORTED:
+            self.unordered.pop(drawable, None)
+            if drawable in self.ordered:
+                self.ordered.remove(drawable)
+                self.remove_from_order(drawable)
+        drawable.camera = None
+
+    #Drawables are culled as they are added, so the camera should be positioned for the frame before anything is drawn
     def add_to_unsorted(self, surface : Surface, x : float, y : float):
+        if not self.is_visible(surface, x, y):
+            return
         drawable = Drawable(surface, x, y, 0)
         self.drawables.append(drawable)
 
     def add_to_sorted(self, surface : Surface, x : float, y : float, y_offset : float):
+        if not self.is_visible(surface, x, y):
+            return
         drawable = Drawable(surface, x, y, y_offset)
         self.sorted_drawables.append(drawable)
-    
+
     def add_to_ceiling(self, surface : Surface, x : float, y : float):
+        if not self.is_visible(surface, x, y):
+            return
         drawable = Drawable(surface, x, y, 0)
         self.ceilings.append(drawable)
 
     def add_to_overlay(self, surface : Surface, x : float, y : float):
+        if not self.is_visible(surface, x, y):
+            return
         drawable = Drawable(surface, x, y, 0)
         self.overlays.append(drawable)
 
-    def draw(self, dest : Surface):
-        #Draw non-sorted drawables first
-        for drawable in self.drawables:
-            dest.blit(drawable.surface, (drawable.x - self.x, drawable.y - self.y))
-        #Draw sorted drawables overtop
-        self.sorted_drawables.sort(key=lambda drawable: drawable.y + drawable.y_offset)
-        for drawable in self.sorted_drawables:
-            dest.blit(drawable.surface, (drawable.x - self.x, drawable.y - self.y))
-        #Draw overlays above that
-        for drawable in self.overlays:
-            dest.blit(drawable.surface, (drawable.x - self.x, drawable.y - self.y))
+    def add_to_screen(self, surface : Surface, x : int, y : int):
+        '''Draws a surface at a position on the screen for this frame only, over everything else. It is not moved with
+        the camera or scaled to its zoom, so this is for interface drawn on top of the world.'''
+        self.screen_blits.append((surface, (x, y)))
+
+    def add_batch(self, layer : int, blits : List[Tuple[Surface, Tuple[int, int]]]):
+        '''Adds blits already in screen space to a layer for this frame only. They are drawn after the rest of the layer
+        in the order given, without being culled, sorted or scaled to the zoom, which makes this the way to draw
+        thousands of small things.'''
+        self.batches[layer].extend(blits)
+        self.batch_size += len(blits)
+
+    def remove_from_order(self, drawable : Drawable):
+        #sorted_order is always sorted by order_key, so the drawable can be found without scanning the whole list
+        start = bisect.bisect_left(self.sorted_order, drawable.order_key, key=attrgetter("order_key"))
+        del self.sorted_order[self.sorted_order.index(drawable, start)]
+
+    def update_sorted_order(self):
+        '''Moves the unordered drawables into place in sorted_order.'''
+        if len(self.unordered) == 0:
+            return
+        order = self.sorted_order
+        key = attrgetter("order_key")
+        #When a lot has moved one sort of the nearly sorted list beats moving drawables one at a time
+        if len(self.unordered) * 8 > len(order):
+            for drawable in self.unordered:
+                drawable.order_key = drawable.sort_key
+                if drawable not in self.ordered:
+                    self.ordered.add(drawable)
+                    order.append(drawable)
+            order.sort(key=key)
+        else:
+            #Take every moved drawable out first, so the rest of the order is sorted while inserting
+            for drawable in self.unordered:
+                if drawable in self.ordered:
+                    self.remove_from_order(drawable)
+                else:
+                    self.ordered.add(drawable)
+            for drawable in self.unordered:
+                drawable.order_key = drawable.sort_key
+                bisect.insort(order, drawable, key=key)
+        self.unordered.clear()
+
+    def update_retained(self, layer : int):
+        '''Culls and, for the sorted layer, orders a layer's retained drawables, then rebuilds its blits.'''
+        drawables = self.retained[layer]
+        if layer == Camera.SORTED:
+            self.update_sorted_order()
+            drawables = self.sorted_order
+        visible = [drawable for drawable in drawables
+                   if drawable.is_visible and drawable.surface != None and self.is_visible(drawable.surface, drawable.x, drawable.y)]
+        self.visible_retained[layer] = visible
+        self.retained_blits[layer] = self.get_layer_blits(visible)
+        self.dirty_layers[layer] = False
+
+    def get_layer_blits(self, drawables : List[Drawable]) -> List[Tuple[Surface, Tuple[int, int]]]:
+        camera_x = self.x
+        camera_y = self.y
+        level = self.level
+        if level == 0:
+            return [(drawable.surface, (drawable.x - camera_x, drawable.y - camera_y)) for drawable in drawables]
+        #Zoomed out, positions are shifted down to the level and surfaces swapped for their scaled copies
+        get_scaled = self.get_scaled
+        return [(get_scaled(drawable.surface), ((drawable.x - camera_x) >> level, (drawable.y - camera_y) >> level)) for drawable in drawables]
+
+    def build_frame(self) -> List[List[Tuple[Surface, Tuple[int, int]]]]:
+        '''Returns the blits of every layer in draw order and clears the drawables that only last a frame.'''
+        #Every cached layer is out of date once the camera moves or zooms
+        if self.cached_position != (self.x, self.y, self.level):
+            self.cached_position = (self.x, self.y, self.level)
+            self.dirty_layers = [True, True, True, True]
+        for layer in (Camera.UNSORTED, Camera.SORTED, Camera.OVERLAY):
+            if self.dirty_layers[layer]:
+                self.update_retained(layer)
+
+        #Non-sorted drawables first
+        batches = self.batches
+        frame = [self.retained_blits[Camera.UNSORTED], self.get_layer_blits(self.drawables)]
+        if len(batches[Camera.UNSORTED]) > 0:
+            frame.append(batches[Camera.UNSORTED])
+        #Sorted drawables overtop
+        if len(self.sorted_drawables) == 0:
+            frame.append(self.retained_blits[Camera.SORTED])
+        else:
+            #The retained drawables are already in order, so sorting only has to order the ones added this frame and
+            #merge the two. Being a stable sort, drawables at the same depth stay in the order they were added.
+            self.sorted_drawables += self.visible_retained[Camera.SORTED]
+            self.sorted_drawables.sort(key=attrgetter("sort_key"))
+            frame.append(self.get_layer_blits(self.sorted_drawables))
+        if len(batches[Camera.SORTED]) > 0:
+            frame.append(batches[Camera.SORTED])
+        #Overlays above that
+        frame.append(self.retained_blits[Camera.OVERLAY])
+        frame.append(self.get_layer_blits(self.overlays))
+        if len(batches[Camera.OVERLAY]) > 0:
+            frame.append(batches[Camera.OVERLAY])
+        #Screen space blits over all of it, the list is replaced rather than cleared for the same reason as the batches
+        if len(self.screen_blits) > 0:
+            frame.append(self.screen_blits)
+            self.screen_blits = []
         #Clear drawables arrays for next frame
         self.drawables.clear()
         self.sorted_drawables.clear()
-        self.overlays.clear()
\ No newline at end of file
+        self.overlays.clear()
+        #The batches may still be being drawn on a render thread, so they are replaced rather than cleared
+        self.has_batches = self.batch_size > 0
+        if self.has_batches:
+            self.batches = [[], [], [], []]
+            self.batch_size = 0
+        Profiler.shared.count("blits", sum(len(blits) for blits in frame))
+        return frame
+
+    def draw(self, dest : Surface):
+        #Each layer is submitted to dest in a single call, fblits skips the per blit overhead of blits
+        for blits in self.build_frame():
+            dest.fblits(blits)
+
+    def invalidate(self, rect : Rect = None):
+        '''Makes draw_dirty redraw a rect of the screen on its next call, or all of it if no rect is given.
+        This is needed when a surface that is already on screen is drawn onto in place.'''
+        if rect == None:
+            self.full_redraw = True
+        else:
+            self.invalid_rects.append(Rect(rect))
+
+    def merge_rects(rects : List[Rect]) -> List[Rect]:
+        '''Joins overlapping rects together so no area is redrawn twice.'''
+        merged : List[Rect] = []
+        for rect in rects:
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def draw_dirty(self, dest : Surface) -> List[Rect]:
+        '''Draws only the parts of dest that changed since the last call, returning the rects to pass to
+        pygame.display.update. Everything moves when the camera scrolls, so then all of dest is redrawn.'''
+        frame = self.build_frame()
+        blits = [blit for layer in frame for blit in layer]
+        if self.has_batches:
+            #Batches tend to be thousands of small moving blits, finding what changed would cost more than redrawing.
+            #The frame after the last batch is redrawn whole too, as it has nothing to compare against.
+            self.previous_frame = {}
+            rects = self.redraw(dest, blits)
+            self.full_redraw = True
+            return rects
+        blit_rects = [Rect(position, surface.get_size()) for surface, position in blits]
+        #Each blit is known by its surface and screen position, anything that is not in both frames has changed
+        current : Dict[Tuple[Surface, Tuple[int, int]], Rect] = dict(zip(blits, blit_rects))
+        previous = self.previous_frame
+        self.previous_frame = current
+
+        dest_rect = dest.get_rect()
+        if (self.full_redraw or self.dirty_position != (self.x, self.y) or self.dirty_size != dest_rect.size):
+            self.dirty_position = (self.x, self.y)
+            self.dirty_size = dest_rect.size
+            return self.redraw(dest, blits)
+
+        rects = self.invalid_rects
+        self.invalid_rects = []
+        for key in previous.keys() ^ current.keys():
+            rect = current.get(key)
+            if rect == None:
+                rect = previous[key]
+            rect = rect.clip(dest_rect)
+            if rect.width > 0 and rect.height > 0:
+                rects.append(rect)
+        rects = Camera.merge_rects(rects)
+
+        #Past a point, one full redraw is cheaper than many partial ones
+        if sum(rect.width * rect.height for rect in rects) * 2 > dest_rect.width * dest_rect.height:
+            return self.redraw(dest, blits)
+
+        for rect in rects:
+            dest.set_clip(rect)
+            dest.fill(self.background_color, rect)
+            dest.blits([blits[index] for index in rect.collidelistall(blit_rects)], doreturn=False)
+        dest.set_clip(None)
+        return rects
+
+    def redraw(self, dest : Surface, blits : List[Tuple[Surface, Tuple[int, int]]]) -> List[Rect]:
+        self.full_redraw = False
+        self.invalid_rects = []
+        dest.fill(self.background_color)
+        dest.fblits(blits)
+        return [dest.get_rect()]
+
+    def get_canvas(self) -> Surface:
+        '''Returns a surface the size of the camera's view to draw to at the art's native resolution.'''
+        if self.canvas == None:
+            self.canvas = Surface((self.width, self.height)).convert()
+            Profiler.shared.count("surfaces")
+        return self.canvas
+
+    def update_present_rect(self, dest : Surface) -> bool:
+        '''Fits the canvas into dest at the largest whole scale, returns True if that changed.'''
+        dest_rect = dest.get_rect()
+        scale = max(1, min(dest_rect.width // self.width, dest_rect.height // self.height))
+        rect = Rect(0, 0, self.width * scale, self.height * scale)
+        rect.center = dest_rect.center
+        if rect == self.present_rect and self.present_target != None and self.present_target.get_parent() is dest:
+            return False
+        self.present_scale = scale
+        self.present_rect = rect
+        self.present_target = dest.subsurface(rect) if dest_rect.contains(rect) else None
+        #Clear the bars around the canvas
+        dest.fill((0, 0, 0))
+        return True
+
+    def present(self, dest : Surface, rects : List[Rect] = None) -> List[Rect]:
+        '''Scales the canvas onto dest in a single pass, centred at the largest whole scale that fits.
+        If rects of the canvas are given only they are scaled. Returns the rects of dest that changed.'''
+        canvas = self.get_canvas()
+        resized = self.update_present_rect(dest)
+        scale = self.present_scale
+        if rects == None or resized:
+            if self.present_target == None:
+                dest.blit(canvas, self.present_rect)
+            else:
+                transform.scale(canvas, self.present_rect.size, self.present_target)
+            return [dest.get_rect()] if resized else [self.present_rect]
+
+        dest_rects = []
+        for rect in rects:
+            dest_rect = Rect(self.present_rect.x + rect.x * scale, self.present_rect.y + rect.y * scale, rect.width * scale, rect.height * scale)
+            if self.present_target == None:
+                dest.blit(canvas, dest_rect, rect)
+            else:
+                transform.scale(canvas.subsurface(rect), dest_rect.size, dest.subsurface(dest_rect))
+            dest_rects.append(dest_rect)
+        return dest_rects
\ No newline at end of file
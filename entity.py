@@ -1,8 +1,9 @@
 from pygame import Surface, Color, draw, SRCALPHA
 from vector import Vector2
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Tuple, Callable
 from tilemap import Tilemap
-from camera import Camera
+from camera import Camera, Drawable
+from profiler import Profiler
 import math
 
 class Collider:
@@ -10,15 +11,22 @@ class Collider:
     
     colliders : Set["Collider"] = set()
 
+    #Every shape has an id, which its subclass sets as shape
+    RECT = 0
+    CIRCLE = 1
+    shape : int = -1
+    #Overlap tests, indexed by the shape of the collider testing and then the shape of the one it tests against
+    tests : Dict[int, Dict[int, Callable[["Collider", "Collider"], bool]]] = {}
+
+    def register_test(shape : int, other_shape : int, test : Callable[["Collider", "Collider"], bool]):
+        Collider.tests.setdefault(shape, {})[other_shape] = test
+
     def collide_all():
         for collider in Collider.colliders:
             for collider2 in Collider.colliders:
                 if collider == collider2:
                     continue
-                if isinstance(collider2, RectCollider):
-                    collider.collide_rect(collider2)
-                else:
-                    collider.collide_circle(collider2)
+                collider.collide(collider2)
 
     def add(collider : "Collider") -> "Collider":
         Collider.colliders.add(collider)
@@ -31,14 +39,33 @@ class Collider:
         self.is_colliding = False
         self.is_area = is_area
         self.parent : Entity = None
+        #Debug drawing, the surface is kept until the color or size it was made for changes
+        self.drawable : Drawable = None
+        self.debug_surface : Surface = None
+        self.debug_key : tuple = None
 
     def __del__(self):
         if self in Collider.colliders:
             Collider.colliders.remove(self)
+        if self.drawable != None:
+            self.drawable.remove()
 
     def draw(self, camera : Camera):
         pass
 
+    def update_drawable(self, camera : Camera, x : float, y : float):
+        '''Keeps this collider's debug surface on the camera's overlay layer.'''
+        if self.drawable == None or self.drawable.camera is not camera:
+            self.drawable = camera.add_retained(Camera.OVERLAY, self.debug_surface, x, y)
+            return
+        self.drawable.set_surface(self.debug_surface)
+        self.drawable.set_position(x, y)
+        self.drawable.set_visible(True)
+
+    def hide_drawable(self):
+        if self.drawable != None:
+            self.drawable.set_visible(False)
+
     def collide_point(self, point : Vector2):
         pass
 
@@ -48,54 +75,70 @@ class Collider:
     def collide_circle(self, collider : "Collider"):
         pass
 
+    def collide(self, collider : "Collider") -> bool:
+        '''Tests for an overlap with a collider of any shape, using the test registered for the pair of shapes.'''
+        test = Collider.tests[self.shape].get(collider.shape)
+        return test != None and test(self, collider)
+
     def get_collisions(self) -> List["Collider"]:
+        tests = Collider.tests[self.shape]
         collisions = []
         for collider in Collider.colliders:
             if collider == self:
                 continue #Don't return self-collisions
-            if isinstance(collider, RectCollider):
-                if self.collide_rect(collider):    
-                    collisions.append(collider)
-            else:
-                if self.collide_circle(collider):    
-                    collisions.append(collider)
+            test = tests.get(collider.shape)
+            if test != None and test(self, collider):
+                collisions.append(collider)
         return collisions
 
     def get_body_collisions(self) -> List["Collider"]:
+        tests = Collider.tests[self.shape]
         collisions = []
         for collider in Collider.colliders:
             if collider == self:
                 continue #Don't return self-collisions
             if collider.is_area:
                 continue #Don't return any area collisions
-            if isinstance(collider, RectCollider):
-                if self.collide_rect(collider):    
-                    collisions.append(collider)
-            else:
-                if self.collide_circle(collider):    
-                    collisions.append(collider)
+            test = tests.get(collider.shape)
+            if test != None and test(self, collider):
+                collisions.append(collider)
         return collisions
     
     def get_area_collisions(self) -> List["Collider"]:
+        tests = Collider.tests[self.shape]
         collisions = []
         for collider in Collider.colliders:
             if collider == self:
                 continue #Don't return self-collisions
             if not collider.is_area:
                 continue #Don't return any body collisions
-            if isinstance(collider, RectCollider):
-                if self.collide_rect(collider):    
-                    collisions.append(collider)
-            else:
-                if self.collide_circle(collider):    
-                    collisions.append(collider)
+            test = tests.get(collider.shape)
+            if test != None and test(self, collider):
+                collisions.append(collider)
         return collisions
+
+    def get_extents(self, axis : int) -> Tuple[float, float, float, float]:
+        '''Returns the position of the collider along an axis (0 for x, 1 for y) and across it, then its size along and across it.'''
+        pass
     
     def get_tile_collisions(self, tilemap : Tilemap) -> List["Collider"]:
         pass
 
+    def get_solid_tiles(self, tilemap : Tilemap, left : int, top : int, right : int, bottom : int) -> List["Collider"]:
+        '''Returns colliders for the solid tiles between two tile positions (inclusive) that this collider touches.
+        Runs of solid tiles come merged into rects by the tilemap, so a wall is one collider rather than one per tile.'''
+        intersecting_tiles = []
+        test = Collider.tests[self.shape][Collider.RECT]
+        for rect in tilemap.get_collision_rects(left, top, right, bottom):
+            tile_collider = RectCollider(rect.x, rect.y, rect.width, rect.height, True, False, Color(255, 255, 255, 50))
+            if test(self, tile_collider):
+                intersecting_tiles.append(tile_collider)
+        return intersecting_tiles
+
 class RectCollider (Collider):
     '''A rectangular collider which can detect collisions'''
+    shape = Collider.RECT
+
     def __init__(self, x : float = 0, y : float = 0, width : float = 1, height : float = 1, 
                  is_visible : bool = False, is_area = True, color : Color = Color(255, 0, 0)):
         super().__init__(x, y, is_visible, is_area, color)
@@ -103,18 +146,24 @@ class RectCollider (Collider):
     
     def draw(self, camera : Camera):
         if not self.is_visible:
+            self.hide_drawable()
             return
         
-        #Generate the surface
-        surface = Surface((self.size.x, self.size.y), SRCALPHA).convert_alpha()
         color = self.color.grayscale()
         if self.is_colliding:
             color = self.color
         self.is_colliding = False
-        surface.fill(color)
 
-        #Add that to the overlay queue
-        camera.add_to_overlay(surface, self.position.x, self.position.y)
+        #Generate the surface
+        debug_key = (color, self.size.x, self.size.y)
+        if self.debug_key != debug_key:
+            self.debug_surface = Surface((self.size.x, self.size.y), SRCALPHA).convert_alpha()
+            Profiler.shared.count("surfaces")
+            self.debug_surface.fill(color)
+            self.debug_key = debug_key
+
+        #Keep it on the overlay layer
+        self.update_drawable(camera, self.position.x, self.position.y)
 
     def collide_point(self, point : Vector2) -> bool:
         colliding_x = False
@@ -131,67 +180,61 @@ class RectCollider (Collider):
     def collide_rect(self, collider : "Collider") -> bool:
         if not isinstance(collider, RectCollider):
             return False #This should only take rects
-        #Horizontal axis
-        colliding_x = False
-        if (self.position.x < collider.position.x + collider.size.x and 
-        self.position.x + self.size.x > collider.position.x):
-            colliding_x = True
-        #Vertical axis
-        colliding_y = False
-        if (self.position.y < collider.position.y + collider.size.y and 
-        self.position.y + self.size.y > collider.position.y):
-            colliding_y = True
-        
-        if colliding_x and colliding_y:
-            self.is_colliding = True
-        return colliding_x and colliding_y
+        return RectCollider.overlaps_rect(self, collider)
 
     def collide_circle(self, collider : "Collider") -> bool:
         if not isinstance(collider, CircleCollider):
             return False #This should only take circles
-        test_x = collider.position.x
-        test_y = collider.position.y
-
-        #Horizontal axis
-        #If circle is to the left of the left edge
-        if collider.position.x < self.position.x:
-            test_x = self.position.x
-        #If the circle is to the right of the right edge
-        elif collider.position.x > self.position.x + self.size.x:
-            test_x = self.position.x + self.size.x
-        
-        #Vertical axis
-        #If circle is below the bottom edge
-        if collider.position.y < self.position.y:
-            test_y = self.position.y
-        #If the circle is above the top edge
-        elif collider.position.y > self.position.y + self.size.y:
-            test_y = self.position.y + self.size.y
-        
-        #Check if that point is in the range
-        dist = (collider.position - Vector2(test_x, test_y)).length()
-        if dist < collider.size:
+        return RectCollider.overlaps_circle(self, collider)
+
+    def overlaps_rect(self, collider : "RectCollider") -> bool:
+        Profiler.shared.count("collision_tests")
+        x, y = self.position.x, self.position.y
+        other_x, other_y = collider.position.x, collider.position.y
+        #Overlapping on both axes
+        if (x < other_x + collider.size.x and x + self.size.x > other_x and
+            y < other_y + collider.size.y and y + self.size.y > other_y):
+            self.is_colliding = True
+            return True
+        return False
+
+    def overlaps_circle(self, collider : "CircleCollider") -> bool:
+        Profiler.shared.count("collision_tests")
+        x, y = self.position.x, self.position.y
+        circle_x, circle_y = collider.position.x, collider.position.y
+        #The closest point of the rect to the circle's center
+        test_x = circle_x
+        if circle_x < x:
+            test_x = x
+        elif circle_x > x + self.size.x:
+            test_x = x + self.size.x
+        test_y = circle_y
+        if circle_y < y:
+            test_y = y
+        elif circle_y > y + self.size.y:
+            test_y = y + self.size.y
+        if math.hypot(circle_x - test_x, circle_y - test_y) < collider.size:
             self.is_colliding = True
             return True
         return False
+
+    def get_extents(self, axis : int) -> Tuple[float, float, float, float]:
+        if axis == 0:
+            return self.position.x, self.position.y, self.size.x, self.size.y
+        return self.position.y, self.position.x, self.size.y, self.size.x
     
     def get_tile_collisions(self, tilemap) -> List[Collider]:
         #Get tiles that are likely to intersect this collider
-        intersecting_tiles = []
-        topleft_tile = tilemap.world_to_tile(Vector2(self.position.x, self.position.y))
-        bottomright_tile = tilemap.world_to_tile(Vector2(self.position.x + self.size.x, self.position.y + self.size.y))
-        for x in range(int(topleft_tile.x), int(bottomright_tile.x + 1)):
-            for y in range(int(topleft_tile.y), int(bottomright_tile.y + 1)):
-                if tilemap.get_tile_type(Vector2(x, y)) == None:
-                    continue
-                tile_collider = RectCollider(x * tilemap.tile_size, y * tilemap.tile_size, tilemap.tile_size, tilemap.tile_size, True, False, Color(255, 255, 255, 50))
-                if tilemap.get_tile_type(Vector2(x, y)).has_collision and self.collide_rect(tile_collider):
-                    intersecting_tiles.append(tile_collider)
-        return intersecting_tiles
+        tile_size = tilemap.tile_size
+        return Collider.get_solid_tiles(self, tilemap, math.floor(self.position.x / tile_size), math.floor(self.position.y / tile_size),
+                                        math.floor((self.position.x + self.size.x) / tile_size),
+                                        math.floor((self.position.y + self.size.y) / tile_size))
 
 
 class CircleCollider (Collider):
     '''A circular collider which can detect collisions'''
+    shape = Collider.CIRCLE
+
     def __init__(self, x : float = 0, y : float = 0, diameter : float = 1, 
                  is_visible : bool = False, is_area = True, color : Color = Color(255, 0, 0)):
         super().__init__(x, y, is_visible, is_area, color)
@@ -199,76 +242,80 @@ class CircleCollider (Collider):
     
     def draw(self, camera : Camera):
         if not self.is_visible:
+            self.hide_drawable()
             return
-        #Generate the surface
-        surface = Surface((self.size * 2, self.size * 2), SRCALPHA).convert_alpha()
         color = self.color.grayscale()
         if self.is_colliding:
             color = self.color
         self.is_colliding = False
-        draw.circle(surface, color, (self.size, self.size), self.size)
 
-        #Add surface to overlay queue
-        camera.add_to_overlay(surface, self.position.x - self.size, self.position.y - self.size)
+        #Generate the surface
+        debug_key = (color, self.size)
+        if self.debug_key != debug_key:
+            self.debug_surface = Surface((self.size * 2, self.size * 2), SRCALPHA).convert_alpha()
+            Profiler.shared.count("surfaces")
+            draw.circle(self.debug_surface, color, (self.size, self.size), self.size)
+            self.debug_key = debug_key
+
+        #Keep it on the overlay layer
+        self.update_drawable(camera, self.position.x - self.size, self.position.y - self.size)
 
     def collide_point(self, point : Vector2) -> bool:
         self.is_colliding = False
-        if (self.position - point).length() < self.size:
+        if math.hypot(self.position.x - point.x, self.position.y - point.y) < self.size:
             self.is_colliding = True
         return self.is_colliding
 
     def collide_rect(self, collider : "Collider"):
         if not isinstance(collider, RectCollider):
             return False #This should only take rects
-        test_x = self.position.x
-        test_y = self.position.y
-
-        #Horizontal axis
-        #If circle is to the left of the left edge
-        if self.position.x < collider.position.x:
-            test_x = collider.position.x
-        #If the circle is to the right of the right edge
-        elif self.position.x > collider.position.x + collider.size.x:
-            test_x = collider.position.x + collider.size.x
-        
-        #Vertical axis
-        #If circle is below the bottom edge
-        if self.position.y < collider.position.y:
-            test_y = collider.position.y
-        #If the circle is above the top edge
-        elif self.position.y > collider.position.y + collider.size.y:
-            test_y = collider.position.y + collider.size.y
-        
-        #Check if that point is in the range
-        dist = (self.position - Vector2(test_x, test_y)).length()
-        if dist - self.size < -0.001:
-            self.is_colliding = True
-            return True
-        return False
+        return CircleCollider.overlaps_rect(self, collider)
 
     def collide_circle(self, collider : "Collider"):
         if not isinstance(collider, CircleCollider):
             return False #This should only take circles
+        return CircleCollider.overlaps_circle(self, collider)
+
+    def overlaps_rect(self, collider : "RectCollider") -> bool:
+        Profiler.shared.count("collision_tests")
+        x, y = self.position.x, self.position.y
+        rect_x, rect_y = collider.position.x, collider.position.y
+        #The closest point of the rect to the circle's center
+        test_x = x
+        if x < rect_x:
+            test_x = rect_x
+        elif x > rect_x + collider.size.x:
+            test_x = rect_x + collider.size.x
+        test_y = y
+        if y < rect_y:
+            test_y = rect_y
+        elif y > rect_y + collider.size.y:
+            test_y = rect_y + collider.size.y
+        if math.hypot(x - test_x, y - test_y) - self.size < -0.001:
+            self.is_colliding = True
+            return True
+        return False
+
+    def overlaps_circle(self, collider : "CircleCollider") -> bool:
+        Profiler.shared.count("collision_tests")
         #Calculate the distance between the centers of the two circles
-        dist = (self.position - collider.position).length()
-        if dist < collider.size + self.size:
+        if math.hypot(self.position.x - collider.position.x, self.position.y - collider.position.y) < collider.size + self.size:
             self.is_colliding = True
             return True
         return False
+
+    def get_extents(self, axis : int) -> Tuple[float, float, float, float]:
+        if axis == 0:
+            return self.position.x, self.position.y, self.size, self.size
+        return self.position.y, self.position.x, self.size, self.size
     
     def get_tile_collisions(self, tilemap) -> List[Collider]:
         #Get tiles that are likely to intersect this collider
-        intersecting_tiles = []
-        topleft_tile = tilemap.world_to_tile(Vector2(self.position.x - self.size, self.position.y - self.size))
-        bottomright_tile = tilemap.world_to_tile(Vector2(self.position.x + self.size, self.position.y + self.size))
-        for x in range(int(topleft_tile.x), int(bottomright_tile.x) + 1):
-            for y in range(int(topleft_tile.y), int(bottomright_tile.y) + 1):
-                if tilemap.get_tile_type(Vector2(x, y)) == None:
-                    continue
-                tile_collider = RectCollider(x * tilemap.tile_size, y * tilemap.tile_size, tilemap.tile_size, tilemap.tile_size, True, False, Color(255, 255, 255, 50))
-                if tilemap.get_tile_type(Vector2(x, y)).has_collision and self.collide_rect(tile_collider):
-                    intersecting_tiles.append(tile_collider)
-        return intersecting_tiles
+        tile_size = tilemap.tile_size
+        return Collider.get_solid_tiles(self, tilemap, math.floor((self.position.x - self.size) / tile_size),
+                                        math.floor((self.position.y - self.size) / tile_size),
+                                        math.floor((self.position.x + self.size) / tile_size),
+                                        math.floor((self.position.y + self.size) / tile_size))
 
 class Entity:
     '''An entity that has physics and handles collisions'''
@@ -285,201 +332,118 @@ class Entity:
     def move_and_collide(self, delta : float, tilemap : Tilemap):
         '''Moves this entity according to its velocity and acceleration vectors, modifying them
         as appropriate to resolve collisions.'''
-
-        #Handle horizontal collisions:
-        self.position.x += self.velocity.x * delta #Update position x
-        self.collider.position.x += self.velocity.x * delta #Update collider position x
-        collider_offset = self.collider.position.x - self.position.x
-
-        collisions : List[Collider] = []
-        if self.velocity.x != 0:
-            collisions = self.collider.get_body_collisions()
-            collisions += self.collider.get_tile_collisions(tilemap)
-
-        has_collided = False
-        for collider in collisions:
-            if isinstance(self.collider, RectCollider) and isinstance(collider, RectCollider):
-                #Resolve the rect-rect collision
-                if (self.velocity.x > 0): #Set the right side of this collider to collider's left side
-                    self.collider.position.x = collider.position.x - self.collider.size.x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-                elif (self.velocity.x < 0): #Set the left side of this collider to collider's right side
-                    self.collider.position.x = collider.position.x + collider.size.x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-            elif isinstance(self.collider, RectCollider) and isinstance(collider, CircleCollider):
-                #Resolve the rect-circle collision
-                #Determine delta_y
-                #Top of rect is below the circle's center
-                if self.collider.position.y > collider.position.y:
-                    delta_y = self.collider.position.y - collider.position.y
-                #Bottom of rect is above the circle's center
-                elif self.collider.position.y + self.collider.size.y < collider.position.y:
-                    delta_y = collider.position.y - (self.collider.position.y + self.collider.size.y)
-                #Circle's center is between the rect's top and bottom
-                else:
-                    delta_y = 0
-
-                delta_x = math.sqrt(collider.size * collider.size - delta_y * delta_y)
-                if (self.velocity.x > 0): #Set the right side of this collider to collider's left side
-                    target_x = collider.position.x - delta_x
-                    self.collider.position.x = target_x - self.collider.size.x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-                elif (self.velocity.x < 0): #Set the left side of this collider to collider's right side
-                    target_x = collider.position.x + delta_x
-                    self.collider.position.x = target_x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-            elif isinstance(self.collider, CircleCollider) and isinstance(collider, RectCollider):
-                #Resolve the circle-rect collision
-                #Determine delta_y
-                #Circle is above the rect's top edge
-                if self.collider.position.y < collider.position.y:
-                    delta_y = collider.position.y - self.collider.position.y
-                #Circle is below the rect's bottom edge
-                elif self.collider.position.y > collider.position.y + collider.size.y:
-                    delta_y = self.collider.position.y - collider.position.y - collider.size.y
-                #Circle is between the rect's bottom and top edges
-                else:
-                    delta_y = 0
-                
-                delta_x = math.sqrt(self.collider.size * self.collider.size - delta_y * delta_y)
-                if self.velocity.x > 0: #Set the right side of this collider to the other's left side
-                    #If the circle already isn't colliding, move on
-                    if self.collider.position.x < collider.position.x - delta_x:
-                        continue
-                    self.collider.position.x = collider.position.x - delta_x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-                elif self.velocity.x < 0: #Set the left side of this collider to the other's right side
-                    #If the circle already isn't colliding, move on
-                    if self.collider.position.x > collider.position.x + collider.size.x + delta_x:
-                        continue
-                    self.collider.position.x = collider.position.x + collider.size.x + delta_x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-
-            elif isinstance(self.collider, CircleCollider) and isinstance(collider, CircleCollider):
-                #Resolve the circle-circle collision
-                #Determine delta_y
-                delta_y = self.collider.position.y - collider.position.y
-                target_dist = self.collider.size + collider.size
-                delta_x = math.sqrt(target_dist * target_dist - delta_y * delta_y)
-                if (self.velocity.x > 0): #Set the right side of this collider to collider's left side
-                    if self.collider.position.x < collider.position.x - delta_x:
-                        continue
-                    self.collider.position.x = collider.position.x - delta_x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-                elif (self.velocity.x < 0): #Set the left side of this collider to collider's right side
-                    if self.collider.position.x > collider.position.x + delta_x:
-                        continue
-                    self.collider.position.x = collider.position.x + delta_x
-                    self.position.x = self.collider.position.x - collider_offset
-                    has_collided = True
-            self.collider.position = self.collider.position.corrected()
-            self.position = self.position.corrected()
-
-        if has_collided:
-            self.velocity.x = 0
-
-        #Handle vertical collisions:
-        self.position.y += self.velocity.y * delta #Update position y
-        self.collider.position.y += self.velocity.y * delta #Update collider position y
-        collider_offset = self.collider.position.y - self.position.y
-
-        collisions = []
-        if self.velocity.y != 0:
-            collisions = self.collider.get_body_collisions()
-            collisions += self.collider.get_tile_collisions(tilemap)
-
+        #Handle horizontal collisions, then vertical ones
+        self.velocity.x = self.move_axis(delta, tilemap, 0, self.velocity.x)
+        self.velocity.y = self.move_axis(delta, tilemap, 1, self.velocity.y)
+
+    def move_axis(self, delta : float, tilemap : Tilemap, axis : int, velocity : float) -> float:
+        '''Moves this entity along one axis (0 for x, 1 for y) and pushes it back out of anything it ends up in.
+        Returns the velocity along the axis, which is 0 if it hit something.'''
+        position = self.position
+        collider_position = self.collider.position
+        if axis == 0:
+            position.x += velocity * delta
+            collider_position.x += velocity * delta
+            collider_offset = collider_position.x - position.x
+        else:
+            position.y += velocity * delta
+            collider_position.y += velocity * delta
+            collider_offset = collider_position.y - position.y
+        if velocity == 0:
+            return velocity
+
+        collisions = self.collider.get_body_collisions()
+        collisions += self.collider.get_tile_collisions(tilemap)
+
+        #Each contact moves the collider out of the one it hit along the axis, working on plain floats until all are resolved
+        resolvers = Entity.resolvers[self.collider.shape]
+        along, across, length, width = self.collider.get_extents(axis)
         has_collided = False
         for collider in collisions:
-            if isinstance(self.collider, RectCollider) and isinstance(collider, RectCollider):
-                #Resolve the rect-rect collision
-                if (self.velocity.y > 0): #Set the right side of this collider to collider's left side
-                    self.collider.position.y = collider.position.y - self.collider.size.y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-                elif (self.velocity.y < 0): #Set the left side of this collider to collider's right side
-                    self.collider.position.y = collider.position.y + collider.size.y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-            elif isinstance(self.collider, RectCollider) and isinstance(collider, CircleCollider):
-                #Resolve the rect-circle collision
-                #Determine delta_x
-                #Left of rect is to the right of the circle's center
-                if self.collider.position.x > collider.position.x:
-                    delta_x = self.collider.position.x - collider.position.x
-                #Right of rect is to the left of the circle's center
-                elif self.collider.position.x + self.collider.size.x < collider.position.x:
-                    delta_x = collider.position.x - (self.collider.position.x + self.collider.size.x)
-                #Circle's center is between the rect's left and right
-                else:
-                    delta_x = 0
-
-                delta_y = math.sqrt(collider.size * collider.size - delta_x * delta_x)
-                if (self.velocity.y > 0): #Set the right side of this collider to collider's left side
-                    target_y = collider.position.y - delta_y
-                    if self.collider.position.y < target_y - self.collider.size.y:
-                        continue
-                    self.collider.position.y = target_y - self.collider.size.y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-                elif (self.velocity.y < 0): #Set the left side of this collider to collider's right side
-                    target_y = collider.position.y + delta_y
-                    if self.collider.position.y > target_y:
-                        continue
-                    self.collider.position.y = target_y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-            elif isinstance(self.collider, CircleCollider) and isinstance(collider, RectCollider):
-                #Resolve the circle-rect collision
-                #Determine delta_x
-                #Left of rect is to the right of the circle's center
-                if self.collider.position.x < collider.position.x:
-                    delta_x = collider.position.x - self.collider.position.x
-                #Right of rect is to the left of the circle's center
-                elif collider.position.x + collider.size.x < self.collider.position.x:
-                    delta_x = self.collider.position.x - (collider.position.x + collider.size.x)
-                #Circle's center is between the rect's top and bottom
-                else:
-                    delta_x = 0
-
-                delta_y = math.sqrt(self.collider.size * self.collider.size - delta_x * delta_x)
-                if (self.velocity.y > 0): #Set the bottom side of this collider to collider's top side
-                    if self.collider.position.y < collider.position.y - delta_y:
-                        continue
-                    self.collider.position.y = collider.position.y - delta_y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-                elif (self.velocity.y < 0): #Set the top side of this collider to collider's bottom side
-                    if self.collider.position.y > collider.position.y + collider.size.y + delta_y:
-                        continue
-                    self.collider.position.y = collider.position.y + collider.size.y + delta_y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-            elif isinstance(self.collider, CircleCollider) and isinstance(collider, CircleCollider):
-                #Resolve the circle-circle collision
-                #Determine delta_x
-                delta_x = self.collider.position.x - collider.position.x
-                target_dist = self.collider.size + collider.size
-                delta_y = math.sqrt(target_dist * target_dist - delta_x * delta_x)
-                if (self.velocity.y > 0): #Set the right side of this collider to collider's left side
-                    if self.collider.position.y < collider.position.y - delta_y:
-                        continue
-                    self.collider.position.y = collider.position.y - delta_y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-                elif (self.velocity.y < 0): #Set the left side of this collider to collider's right side
-                    if self.collider.position.y > collider.position.y + delta_y:
-                        continue
-                    self.collider.position.y = collider.position.y + delta_y
-                    self.position.y = self.collider.position.y - collider_offset
-                    has_collided = True
-            self.collider.position = self.collider.position.corrected()
-            self.position = self.position.corrected()
-        if has_collided:
-            self.velocity.y = 0
\ No newline at end of file
+            resolver = resolvers.get(collider.shape)
+            if resolver == None:
+                continue
+            target = resolver(along, across, length, width, *collider.get_extents(axis), velocity)
+            if target == None:
+                continue #Already pushed out of this one by an earlier contact
+            along = target
+            has_collided = True
+
+        if not has_collided:
+            return velocity
+        if axis == 0:
+            collider_position.x = along
+            position.x = along - collider_offset
+        else:
+            collider_position.y = along
+            position.y = along - collider_offset
+        collider_position.correct()
+        position.correct()
+        return 0
+
+    #Resolvers take the position, across position, length and width of the moving collider along an axis, the same
+    #of the collider it hit and its velocity along the axis. They return where the moving collider has to be along
+    #the axis to no longer overlap, or None if it already doesn't. Rects are positioned by their top-left corner
+    #and circles by their center with their radius as both sizes.
+    resolvers : Dict[int, Dict[int, Callable[..., float]]] = {}
+
+    def register_resolver(shape : int, other_shape : int, resolver : Callable[..., float]):
+        Entity.resolvers.setdefault(shape, {})[other_shape] = resolver
+
+    def resolve_rect_rect(along : float, across : float, length : float, width : float,
+                          other_along : float, other_across : float, other_length : float, other_width : float, velocity : float) -> float:
+        if velocity > 0: #Set the far side of this collider to the other's near side
+            return other_along - length
+        return other_along + other_length #Set the near side of this collider to the other's far side
+
+    def resolve_rect_circle(along : float, across : float, length : float, width : float,
+                            other_along : float, other_across : float, radius : float, other_width : float, velocity : float) -> float:
+        #How far the circle's center is past the rect's sides across the axis
+        if across > other_across:
+            delta = across - other_across
+        elif across + width < other_across:
+            delta = other_across - (across + width)
+        else:
+            delta = 0
+        reach = math.sqrt(radius * radius - delta * delta)
+        if velocity > 0:
+            target = other_along - reach - length
+            return None if along < target else target
+        target = other_along + reach
+        return None if along > target else target
+
+    def resolve_circle_rect(along : float, across : float, radius : float, width : float,
+                            other_along : float, other_across : float, other_length : float, other_width : float, velocity : float) -> float:
+        #How far the circle's center is past the rect's sides across the axis
+        if across < other_across:
+            delta = other_across - across
+        elif across > other_across + other_width:
+            delta = across - (other_across + other_width)
+        else:
+            delta = 0
+        reach = math.sqrt(radius * radius - delta * delta)
+        if velocity > 0:
+            target = other_along - reach
+            return None if along < target else target
+        target = other_along + other_length + reach
+        return None if along > target else target
+
+    def resolve_circle_circle(along : float, across : float, radius : float, width : float,
+                              other_along : float, other_across : float, other_radius : float, other_width : float, velocity : float) -> float:
+        delta = across - other_across
+        target_dist = radius + other_radius
+        reach = math.sqrt(target_dist * target_dist - delta * delta)
+        if velocity > 0:
+            target = other_along - reach
+            return None if along < target else target
+        target = other_along + reach
+        return None if along > target else target
+
+Collider.register_test(Collider.RECT, Collider.RECT, RectCollider.overlaps_rect)
+Collider.register_test(Collider.RECT, Collider.CIRCLE, RectCollider.overlaps_circle)
+Collider.register_test(Collider.CIRCLE, Collider.RECT, CircleCollider.overlaps_rect)
+Collider.register_test(Collider.CIRCLE, Collider.CIRCLE, CircleCollider.overlaps_circle)
+Entity.register_resolver(Collider.RECT, Collider.RECT, Entity.resolve_rect_rect)
+Entity.register_resolver(Collider.RECT, Collider.CIRCLE, Entity.resolve_rect_circle)
+Entity.register_resolver(Collider.CIRCLE, Collider.RECT, Entity.resolve_circle_rect)
+Entity.register_resolver(Collider.CIRCLE, Collider.CIRCLE, Entity.resolve_circle_circle)
@@ -0,0 +1,191 @@
+from typing import Dict, List, Tuple
+from scheduler import Scheduler
+from profiler import Profiler
+import os, struct
+
+class TileJournal:
+    '''Saves the tiles of a Tilemap as they are edited. Every tile that changes is kept until save is called, which
+    appends them to a journal file, so saving costs as much as the edits since the last save, not the size of the
+    world. Once enough edits have built up the journal is compacted in the background through the Scheduler, the
+    whole tilemap is written out to a snapshot grouped into chunks and the journal is started again.
+
+    A world is kept in path + ".snapshot" and path + ".journal". While a compaction is under way edits are appended
+    to path + ".journal.next" instead, which is moved over the journal once the new snapshot is in place. Loading
+    applies the snapshot and then whichever journals are there in order, each edit only ever setting a tile to the
+    id it had at that point, so a compaction cut off part way through loses nothing.'''
+    JOURNAL_MAGIC = b"IMTJ"
+    SNAPSHOT_MAGIC = b"IMTS"
+    VERSION = 1
+    #Magic and version
+    JOURNAL_HEADER = struct.Struct("<4sH")
+    #Tile position and id, -1 for a removed tile
+    EDIT = struct.Struct("<iih")
+    #Magic, version and the width of the square chunks the tiles are grouped in
+    SNAPSHOT_HEADER = struct.Struct("<4sHH")
+    #Chunk position and the number of tiles that follow
+    CHUNK = struct.Struct("<iiI")
+    #Position of a tile in its chunk and its id
+    TILE = struct.Struct("<BBh")
+
+    def __init__(self, path : str, compact_edits : int = 4096, chunk_size : int = 32):
+        #Positions in a chunk are saved as single bytes
+        if chunk_size < 1 or chunk_size > 256:
+            raise ValueError("Snapshot chunks have to be between 1 and 256 tiles wide, not " + str(chunk_size))
+        self.snapshot_path = path + ".snapshot"
+        self.journal_path = path + ".journal"
+        self.next_journal_path = self.journal_path + ".next"
+        #Edits saved to the journal since it was last compacted, it is compacted once there are compact_edits of them
+        self.compact_edits = compact_edits
+        self.chunk_size = chunk_size
+        self.saved_edits = 0
+        #Edits not yet saved, only the last id set at each position is kept
+        self.pending : Dict[Tuple[int, int], int] = {}
+        self.tilemap : "Tilemap" = None
+        self.file = None
+        self.compact_job : Scheduler.Job = None
+
+    def attach(self, tilemap : "Tilemap") -> bool:
+        '''Loads the saved world into a tilemap, then records its edits from then on. Returns False if nothing was saved yet.'''
+        tiles : Dict[Tuple[int, int], int] = {}
+        has_loaded = TileJournal.read_snapshot(self.snapshot_path, tiles)
+        for path in (self.journal_path, self.next_journal_path):
+            edit_count = TileJournal.read_journal(path, tiles)
+            if edit_count >= 0:
+                has_loaded = True
+                self.saved_edits += edit_count
+        #Every chunk the saved tiles touch is built once, with nothing journaled again
+        tilemap.set_tiles(tiles)
+        self.tilemap = tilemap
+        tilemap.journal = self
+        self.open_journal(self.next_journal_path if os.path.exists(self.next_journal_path) else self.journal_path)
+        return has_loaded
+
+    def read_snapshot(path : str, tiles : Dict[Tuple[int, int], int]) -> bool:
+        '''Adds the tiles of a snapshot to tiles, returns False if there is no snapshot. A snapshot cut off part way
+        through has the tiles of its whole chunks added, one too short for its header has none.'''
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < TileJournal.SNAPSHOT_HEADER.size:
+            return True
+        magic, version, chunk_size = TileJournal.SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != TileJournal.SNAPSHOT_MAGIC or version != TileJournal.VERSION:
+            raise ValueError("Not a tile snapshot, or one from another version: " + path)
+        offset = TileJournal.SNAPSHOT_HEADER.size
+        while offset + TileJournal.CHUNK.size <= len(data):
+            chunk_x, chunk_y, tile_count = TileJournal.CHUNK.unpack_from(data, offset)
+            offset += TileJournal.CHUNK.size
+            end = offset + tile_count * TileJournal.TILE.size
+            if end > len(data):
+                break
+            base_x = chunk_x * chunk_size
+            base_y = chunk_y * chunk_size
+            for x, y, id in TileJournal.TILE.iter_unpack(data[offset:end]):
+                tiles[(base_x + x, base_y + y)] = id
+            offset = end
+        return True
+
+    def read_journal(path : str, tiles : Dict[Tuple[int, int], int]) -> int:
+        '''Applies the edits of a journal to tiles, returns how many there were or -1 if there is no journal.'''
+        if not os.path.exists(path):
+            return -1
+        with open(path, "rb") as file:
+            data = file.read()
+        #Cut off before its header was whole, so no edits were saved to it
+        if len(data) < TileJournal.JOURNAL_HEADER.size:
+            return 0
+        magic, version = TileJournal.JOURNAL_HEADER.unpack_from(data, 0)
+        if magic != TileJournal.JOURNAL_MAGIC or version != TileJournal.VERSION:
+            raise ValueError("Not a tile journal, or one from another version: " + path)
+        #An edit cut off by the program stopping while it was written is left out
+        offset = TileJournal.JOURNAL_HEADER.size
+        edit_count = (len(data) - offset) // TileJournal.EDIT.size
+        for x, y, id in TileJournal.EDIT.iter_unpack(data[offset:offset + edit_count * TileJournal.EDIT.size]):
+            tiles[(x, y)] = id
+        return edit_count
+
+    def open_journal(self, path : str):
+        '''Opens a journal to append edits to. Anything cut off at the end of it is dropped first, so new edits
+        line up with the whole ones already there.'''
+        self.file = open(path, "ab")
+        size = self.file.tell()
+        header_size = TileJournal.JOURNAL_HEADER.size
+        if size < header_size:
+            self.file.truncate(0)
+            self.file.write(TileJournal.JOURNAL_HEADER.pack(TileJournal.JOURNAL_MAGIC, TileJournal.VERSION))
+        elif (size - header_size) % TileJournal.EDIT.size != 0:
+            self.file.truncate(size - (size - header_size) % TileJournal.EDIT.size)
+
+    def record(self, x : int, y : int, id : int):
+        self.pending[(x, y)] = id
+
+    def save(self):
+        '''Appends the edits made since the last save to the journal, and starts compacting it if it has grown enough.'''
+        if len(self.pending) > 0:
+            self.file.write(b"".join(TileJournal.EDIT.pack(x, y, id) for (x, y), id in self.pending.items()))
+            self.file.flush()
+            Profiler.shared.count("saved_edits", len(self.pending))
+            self.saved_edits += len(self.pending)
+            self.pending.clear()
+        if self.saved_edits >= self.compact_edits and self.compact_job == None:
+            self.compact_job = Scheduler.shared.add(self.compact_steps(), Scheduler.SAVE_PRIORITY)
+
+    def compact_steps(self, tiles_per_step : int = 4096):
+        '''Writes every tile to a new snapshot tiles_per_step at a time, then drops the journal it replaces.'''
+        try:
+            #Edits from here on go to the next journal, the ones before it are all in the snapshot
+            self.save()
+            tiles = list(self.tilemap.tiles.items())
+            self.file.close()
+            self.open_journal(self.next_journal_path)
+            self.saved_edits = 0
+
+            chunks : Dict[Tuple[int, int], List[Tuple[int, int, int]]] = {}
+            chunk_size = self.chunk_size
+            for start in range(0, len(tiles), tiles_per_step):
+                yield
+                for (x, y), id in tiles[start:start + tiles_per_step]:
+                    chunk_x = x // chunk_size
+                    chunk_y = y // chunk_size
+                    chunk = chunks.get((chunk_x, chunk_y))
+                    if chunk == None:
+                        chunk = []
+                        chunks[(chunk_x, chunk_y)] = chunk
+                    chunk.append((x - chunk_x * chunk_size, y - chunk_y * chunk_size, id))
+
+            #Written next to the old snapshot and swapped in at the end, so there is always a whole one
+            temp_path = self.snapshot_path + ".tmp"
+            with open(temp_path, "wb") as file:
+                file.write(TileJournal.SNAPSHOT_HEADER.pack(TileJournal.SNAPSHOT_MAGIC, TileJournal.VERSION, chunk_size))
+                tile_count = 0
+                for (chunk_x, chunk_y), chunk in chunks.items():
+                    if tile_count >= tiles_per_step:
+                        tile_count = 0
+                        yield
+                    file.write(TileJournal.CHUNK.pack(chunk_x, chunk_y, len(chunk)))
+                    file.write(b"".join(TileJournal.TILE.pack(x, y, id) for x, y, id in chunk))
+                    tile_count += len(chunk)
+            os.replace(temp_path, self.snapshot_path)
+
+            #The old journal is covered by the snapshot now, so the next one takes its place
+            self.file.close()
+            os.replace(self.next_journal_path, self.journal_path)
+            self.open_journal(self.journal_path)
+        finally:
+            self.compact_job = None
+
+    def close(self):
+        '''Saves any edits left, finishing a compaction under way first.'''
+        if self.compact_job != None:
+            Scheduler.shared.finish(self.compact_job)
+        if self.file != None:
+            self.save()
+            #Saving may have queued a compaction, which can wait for the next run
+            if self.compact_job != None:
+                self.compact_job.cancel()
+                self.compact_job = None
+            self.file.close()
+            self.file = None
+        if self.tilemap != None and self.tilemap.journal is self:
+            self.tilemap.journal = None
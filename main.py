@@ -1,36 +1,96 @@
-import pygame, time
+import pygame, time, argparse, os, math
+from typing import Dict, List
 from tilemap import Tilemap
 from entity import Collider, RectCollider, CircleCollider, Entity
 from vector import Vector2
-from sprite import Sprite
+from sprite import Sprite, AnimationSystem
 from camera import Camera
-
-pygame.init()
+from pipeline import RenderThread
+from assets import AssetManager, Asset
+from profiler import Profiler
+from recording import InputRecorder, InputReplay
+from scheduler import Scheduler
+from journal import TileJournal
+from particles import ParticleSystem
 
 class Main:
     """The entry point of the program"""
-    def __init__(self):
-        self.screen = pygame.display.set_mode((640, 360))
-        pygame.display.set_caption("Imora")
+    SCREEN_SIZE = (640, 360)
+    BACKGROUND_COLOR = (0, 255, 0)
+    HEADLESS_DELTA = 1 / 60
+    #Seconds of each frame given to background jobs
+    JOB_BUDGET = 0.004
+    #Seconds between saves of the tiles edited, when a world is being saved
+    AUTOSAVE_INTERVAL = 5.0
+    #Dust particles kicked up per second while walking
+    DUST_RATE = 30
+
+    def __init__(self, headless : bool = False, dirty_rects : bool = False, pipelined : bool = False, scale : int = 1, profile_overlay : bool = False, world_path : str = ""):
+        self.headless = headless
+        self.profile_overlay = profile_overlay
+        self.dirty_rects = dirty_rects
+        self.screen : pygame.Surface = None
+        if not headless:
+            self.screen = pygame.display.set_mode((Main.SCREEN_SIZE[0] * scale, Main.SCREEN_SIZE[1] * scale))
+            pygame.display.set_caption("Imora")
         self.clock = pygame.time.Clock()
         self.delta = 0
+        #Frames are written to the recorder as they happen, or read from the replay instead of the window and clock
+        self.recorder : InputRecorder = None
+        self.replay : InputReplay = None
         self.mouse_down = False
+        self.mouse_position : Vector2 = Vector2(0, 0)
         self.movement : Vector2 = Vector2(0, 0)
         self.previous_time : float = time.time()
+        self.job_budget : float = Main.JOB_BUDGET
         self.delta : float
 
         self.collider : CircleCollider = Collider.add(CircleCollider(100, 100, 50, True, False))
         self.collider2 : CircleCollider = Collider.add(CircleCollider(100, 50, 50, True, False, pygame.Color(0, 0, 255, 200)))
         self.entity : Entity = Entity(50, 50, RectCollider(8, 24, 16, 8, True, False, pygame.Color(200, 0, 200, 200)))
-        self.sprite : Sprite = Sprite(0, 0, 48, pygame.image.load("Images/KarenTieflingStill.png"))
+        self.still_image : Asset = None if headless else AssetManager.shared.acquire("Images/KarenTieflingStill.png")
+        self.sprite : Sprite = Sprite(0, 0, 48, None if headless else self.still_image.get())
         self.walking : bool = False
         self.tilemap : Tilemap = Tilemap()
-        self.camera : Camera = Camera(0, 0)
+        #Edits to the tilemap are journaled and saved every AUTOSAVE_INTERVAL seconds if a world path is given
+        self.journal : TileJournal = None
+        self.autosave_timer : float = 0.0
+        self.camera : Camera = Camera(0, 0, Main.SCREEN_SIZE[0], Main.SCREEN_SIZE[1])
+        self.camera.background_color = Main.BACKGROUND_COLOR
+        #Everything is drawn at SCREEN_SIZE, then scaled up to the window in one pass if it is bigger
+        self.canvas : pygame.Surface = self.screen
+        if not headless and scale != 1:
+            self.canvas = self.camera.get_canvas()
+        #Pipelined rendering always redraws the whole screen, so it takes over from dirty rects
+        self.render_thread : RenderThread = None
+        if pipelined and not headless:
+            self.render_thread = RenderThread(self.canvas, None if self.canvas is self.screen else self.present)
+            self.dirty_rects = False
 
         self.sprite.add_animation("KarenWalk", "Images/KarenWalk.png", 32, 64, 12, 12, True)
         self.sprite.add_animation("KarenIdle", "Images/KarenIdle.png", 32, 64, 45, 12, True)
         self.sprite.play("KarenIdle")
+        #Every animated sprite is advanced in one step during simulate, without loading any frames
+        self.animation_system : AnimationSystem = AnimationSystem()
+        self.animation_system.add(self.sprite)
+        if not headless:
+            #Walking is loaded over the first few frames, so starting to walk does not stall
+            Sprite.animations["KarenWalk"].preload(True)
+        #Headless runs have nothing to draw dust with, so they have none
+        self.dust : ParticleSystem = None
+        self.dust_timer : float = 0.0
+        if not headless:
+            self.dust = ParticleSystem(ParticleSystem.make_dot_frames((190, 170, 140), 2, 4), tilemap=self.tilemap)
+            self.dust.drag = 3.0
 
+        if world_path != "":
+            self.journal = TileJournal(world_path)
+            if self.journal.attach(self.tilemap):
+                return
+        self.build_room()
+
+    def build_room(self):
+        """Lays out the starting room, for when there is no saved world to load"""
         for x in range(10):
             for y in range(10):
                 self.tilemap.set_tile(Vector2(x, y), 1)
@@ -45,18 +105,76 @@ class Main:
 
     def update(self) -> bool:
         """Runs once every frame and returns False when it should exit the program"""
-        self.delta = time.time() - self.previous_time
-        self.previous_time = time.time()
-        #print(1/self.delta)
+        events : List[pygame.event.Event] = None
+        if self.replay != None:
+            #Replays step by the recorded deltas, as fast as the frames can be run
+            frame = self.replay.read_frame()
+            if frame == None:
+                return False
+            self.delta, events = frame
+        elif self.headless:
+            #Headless runs step at a fixed rate, as fast as the simulation allows
+            self.delta = Main.HEADLESS_DELTA
+        else:
+            self.delta = time.time() - self.previous_time
+            self.previous_time = time.time()
+        profiler = Profiler.shared
+        profiler.begin_frame()
+
+        with profiler.phase("input"):
+            if events == None:
+                events = [] if self.headless else pygame.event.get()
+            if self.recorder != None:
+                self.recorder.record(self.delta, events)
+            is_running = self.handle_events(events)
+        if not is_running:
+            return False
+        self.simulate(self.delta)
+        if self.journal != None:
+            self.autosave_timer += self.delta
+            if self.autosave_timer >= Main.AUTOSAVE_INTERVAL:
+                self.autosave_timer = 0.0
+                with profiler.phase("save"):
+                    self.journal.save()
+        if not self.headless:
+            if self.render_thread != None:
+                self.render_pipelined()
+            else:
+                self.render()
+        #The time spent waiting on the clock is left out of the frame
+        profiler.end_frame()
+        if not self.headless and self.replay == None:
+            self.clock.tick(60)  # limits FPS to 60
+        return True
+
+    def close(self):
+        if self.render_thread != None:
+            self.render_thread.stop()
+        if self.recorder != None:
+            self.recorder.close()
+        if self.journal != None:
+            self.journal.close()
 
+    def get_memory_usage(self) -> Dict[str, int]:
+        """Returns the bytes of pixel data held by each kind of surface"""
+        usage = self.tilemap.get_memory_usage()
+        usage["animation_frames"] = Sprite.get_memory_usage()
+        usage["assets"] = AssetManager.shared.get_memory_usage()
+        return usage
+
+    def handle_events(self, events : List[pygame.event.Event]) -> bool:
+        """Applies a frame's input events, returns False if the program was asked to quit"""
         movement_updated = False
 
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 return False
+            if event.type == pygame.MOUSEMOTION:
+                self.mouse_position = Vector2.from_tuple(event.pos)
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
                     self.mouse_down = True
+                    self.mouse_position = Vector2.from_tuple(event.pos)
             if event.type == pygame.MOUSEBUTTONUP:
                 if event.button == 1:
                     self.mouse_down = False
@@ -75,6 +193,9 @@ class Main:
                     self.sprite.flip_x = False
                     self.movement.x += 1
                     movement_updated = True
+                if event.key == pygame.K_z:
+                    #Zooms out a level at a time for an overview of the map, then back in
+                    self.camera.set_zoom(1 if self.camera.level == Camera.MAX_LEVEL else self.camera.zoom / 2)
             if event.type == pygame.KEYUP:
                 if event.key == pygame.K_w:
                     self.movement.y += 1
@@ -96,33 +217,131 @@ class Main:
             elif self.walking == False:
                 self.walking = True
                 self.sprite.play("KarenWalk")
+        return True
 
+    def simulate(self, delta : float):
+        """Advances the world by delta seconds, this never touches the display"""
         self.entity.velocity = self.movement.normalized() * 10 * 16
-        self.entity.move_and_collide(self.delta, self.tilemap)
+        with Profiler.shared.phase("move_and_collide"):
+            self.entity.move_and_collide(delta, self.tilemap)
         self.sprite.position = self.entity.position + Vector2(0, -16)
-        self.camera.set_position(self.entity.position - (Vector2.from_tuple(self.screen.get_size()) * 0.5) + Vector2(16, 16))
+        self.animation_system.update(delta)
+        if self.dust != None:
+            if self.walking:
+                #Whole particles are emitted, the fraction left over carries on to the next frame
+                self.dust_timer += delta * Main.DUST_RATE
+                count = int(self.dust_timer)
+                self.dust_timer -= count
+                feet = self.entity.collider.position
+                self.dust.emit(feet.x + 8, feet.y + 6, count, (10, 40), (0.3, 0.6), -math.pi / 2, math.pi)
+            self.dust.update(delta)
+        self.camera.set_position(self.entity.position - (Vector2(self.camera.view_width, self.camera.view_height) * 0.5) + Vector2(16, 16))
 
         if (self.mouse_down):
-            world_pos = self.camera.screen_to_world(Vector2.from_tuple(pygame.mouse.get_pos()))
+            world_pos = self.camera.screen_to_world(self.camera.window_to_screen(self.mouse_position))
             self.tilemap.set_tile(self.tilemap.world_to_tile(world_pos), 3)
 
-        # Draw graphics
-        self.screen.fill((0, 255, 0))
-        self.tilemap.draw(self.camera)
+    def prepare_frame(self):
+        """Puts everything on the camera, all textures are created on demand from here"""
+        profiler = Profiler.shared
+        #Background work gets its budget before drawing, so bakes it finishes show this frame
+        with profiler.phase("jobs"):
+            Scheduler.shared.run(self.job_budget)
+        with profiler.phase("tilemap_draw"):
+            self.tilemap.draw(self.camera)
         self.collider.draw(self.camera)
         self.collider2.draw(self.camera)
-        self.sprite.draw(self.camera, self.delta)
+        with profiler.phase("sprite_draw"):
+            self.sprite.draw(self.camera)
+            if self.dust != None:
+                self.dust.draw(self.camera)
         self.entity.collider.draw(self.camera)
+        if self.profile_overlay:
+            profiler.draw_overlay(self.camera)
+
+    def render_pipelined(self):
+        """Shows the frame the render thread drew while this one was simulated, then hands it the next"""
+        #Surfaces can only be created or changed while the render thread is idle
+        with Profiler.shared.phase("flip"):
+            self.render_thread.wait()
+            pygame.display.flip()
+        self.prepare_frame()
+        #The blits happen on the render thread, this is only the time taken to hand them over
+        with Profiler.shared.phase("camera_draw"):
+            self.render_thread.submit(self.camera.background_color, self.camera.build_frame())
+
+    def present(self, rects : List[pygame.Rect] = None) -> List[pygame.Rect]:
+        """Scales the canvas up to the window, if they are not the same surface"""
+        if self.canvas is self.screen:
+            return rects
+        return self.camera.present(self.screen, rects)
+
+    def render(self):
+        """Draws the world to the screen"""
+        profiler = Profiler.shared
+        if not self.dirty_rects:
+            self.canvas.fill(Main.BACKGROUND_COLOR)
+        self.prepare_frame()
+
+        if self.dirty_rects:
+            #Only push the parts of the screen that changed
+            with profiler.phase("camera_draw"):
+                rects = self.camera.draw_dirty(self.canvas)
+            with profiler.phase("flip"):
+                pygame.display.update(self.present(rects))
+            return
         
-        self.camera.draw(self.screen)
+        with profiler.phase("camera_draw"):
+            self.camera.draw(self.canvas)
+        with profiler.phase("flip"):
+            self.present()
+            # flip() the display to put your work on screen
+            pygame.display.flip()
 
-        # flip() the display to put your work on screen
-        pygame.display.flip()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imora")
+    parser.add_argument("--headless", action="store_true", help="run the simulation without a window")
+    parser.add_argument("--frames", type=int, default=0, help="stop after this many frames, 0 runs until closed")
+    parser.add_argument("--dirty-rects", action="store_true", help="only redraw the parts of the screen that change")
+    parser.add_argument("--pipelined", action="store_true", help="draw each frame on a render thread while the next is simulated")
+    parser.add_argument("--scale", type=int, default=1, help="whole number to scale the window up by")
+    parser.add_argument("--profile", action="store_true", help="time each phase of the frame and print a summary on exit")
+    parser.add_argument("--profile-overlay", action="store_true", help="show the profiler's timings on screen, implies --profile")
+    parser.add_argument("--profile-out", type=str, default="", help="write the profiler's samples to a .csv or .json file, implies --profile")
+    parser.add_argument("--job-budget", type=float, default=Main.JOB_BUDGET * 1000, help="milliseconds of each frame to spend on background jobs")
+    parser.add_argument("--record", type=str, default="", help="write every frame's input and delta to a file to replay later")
+    parser.add_argument("--world", type=str, default="", help="load the tilemap from this path and save edits to it, the starting room is used if nothing is saved there")
+    parser.add_argument("--replay", type=str, default="", help="play back a recording without a window as fast as possible, implies --profile")
+    args = parser.parse_args()
 
-        self.clock.tick(60)  # limits FPS to 60
-        return True
+    replay : InputReplay = None
+    if args.replay != "":
+        replay = InputReplay(args.replay)
+        #Mouse positions were recorded against a window of this scale
+        args.scale = replay.scale
+        #Frames are still drawn so they are timed, just to a window that is never shown
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    Profiler.shared.is_enabled = args.profile or args.profile_overlay or args.profile_out != "" or replay != None
+    if not args.headless:
+        pygame.init()
+    main = Main(args.headless, args.dirty_rects, args.pipelined, args.scale, args.profile_overlay, args.world)
+    main.replay = replay
+    main.job_budget = args.job_budget / 1000
+    if args.record != "":
+        main.recorder = InputRecorder(args.record, args.scale)
 
-main = Main()
+    frame = 0
+    while main.update():
+        frame += 1
+        if args.frames > 0 and frame >= args.frames:
+            break
+    main.close()
 
-while main.update():
-    pass
\ No newline at end of file
+    if Profiler.shared.is_enabled:
+        for name, stats in Profiler.shared.summary().items():
+            print("%-18s mean %8.3f  p50 %8.3f  p95 %8.3f  p99 %8.3f  max %8.3f" %
+                  (name, stats["mean"], stats["p50"], stats["p95"], stats["p99"], stats["max"]))
+        for name, size in main.get_memory_usage().items():
+            print("%-18s %10.1f KiB" % (name, size / 1024))
+        if args.profile_out != "":
+            Profiler.shared.export(args.profile_out)
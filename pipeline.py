@@ -0,0 +1,63 @@
+from pygame import Surface
+from typing import List, Tuple, Callable
+import threading
+
+class RenderThread:
+    '''Draws frames on a worker thread so the main thread can simulate the next frame in the meantime.
+    Frames are handed over as command lists from Camera.build_frame, one being drawn while the next is built.
+    Neither the lists nor the surfaces in them may be changed once submitted, wait() before touching them.
+    If present is given it is also called on the thread once each frame is drawn, to scale dest to the window.'''
+    def __init__(self, dest : Surface, present : Callable[[], None] = None):
+        self.dest = dest
+        self.present = present
+        self.pending : Tuple[Tuple, Tuple[List[Tuple[Surface, Tuple[int, int]]], ...]] = None
+        self.error : BaseException = None
+        self.is_running = True
+        self.has_work = threading.Condition()
+        self.is_idle = threading.Event()
+        self.is_idle.set()
+        self.thread = threading.Thread(target=self.run, name="RenderThread", daemon=True)
+        self.thread.start()
+
+    def submit(self, background_color : Tuple, frame : List[List[Tuple[Surface, Tuple[int, int]]]]):
+        '''Hands a frame to the thread, waiting for the previous one to finish first.'''
+        self.wait()
+        self.is_idle.clear()
+        with self.has_work:
+            self.pending = (background_color, tuple(frame))
+            self.has_work.notify()
+
+    def wait(self):
+        '''Blocks until the last submitted frame has been drawn to dest.'''
+        self.is_idle.wait()
+        if self.error != None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def run(self):
+        while True:
+            with self.has_work:
+                while self.pending == None and self.is_running:
+                    self.has_work.wait()
+                if not self.is_running:
+                    return
+                background_color, frame = self.pending
+                self.pending = None
+            try:
+                #pygame lets go of the GIL while blitting, so this runs alongside the main thread
+                self.dest.fill(background_color)
+                for blits in frame:
+                    self.dest.blits(blits, doreturn=False)
+                if self.present != None:
+                    self.present()
+            except BaseException as error:
+                self.error = error
+            self.is_idle.set()
+
+    def stop(self):
+        self.is_idle.wait()
+        with self.has_work:
+            self.is_running = False
+            self.has_work.notify()
+        self.thread.join()
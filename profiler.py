@@ -0,0 +1,181 @@
+from pygame import Surface
+from typing import Dict, List
+import pygame, time, json, csv
+import numpy as np
+
+class Profiler:
+    '''Times the phases of each frame and counts the work done in them. The last capacity frames are kept in
+    ring buffers, so percentiles can be taken over them to find spikes. Phases are timed in milliseconds
+    with perf_counter. Does nothing while is_enabled is False, so calls to it can stay in shipped code.'''
+    shared : "Profiler" = None
+
+    class Phase:
+        '''Times a phase for the length of a with block.'''
+        def __init__(self, profiler : "Profiler", name : str):
+            self.profiler = profiler
+            self.name = name
+
+        def __enter__(self):
+            self.profiler.start(self.name)
+            return self
+
+        def __exit__(self, *args):
+            self.profiler.stop(self.name)
+
+    def __init__(self, capacity : int = 600):
+        self.is_enabled = False
+        self.capacity = capacity
+        #Ring buffers of every phase and counter seen, indexed by frame_count % capacity
+        self.timings : Dict[str, np.ndarray] = {}
+        self.counters : Dict[str, np.ndarray] = {}
+        self.frame_count = 0
+        self.frame_start : float = None
+        self.phase_starts : Dict[str, float] = {}
+        self.frame_timings : Dict[str, float] = {}
+        self.frame_counters : Dict[str, int] = {}
+        self.font : pygame.font.Font = None
+        self.overlay : Surface = None
+        self.overlay_time = 0.0
+
+    def begin_frame(self):
+        if not self.is_enabled:
+            return
+        #Work counted before the frame began, like loading, is left out of it
+        self.frame_timings.clear()
+        self.frame_counters.clear()
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        '''Records the frame's total time along with its phases and counters.'''
+        if not self.is_enabled or self.frame_start == None:
+            return
+        self.frame_timings["total"] = time.perf_counter() - self.frame_start
+        self.frame_start = None
+        slot = self.frame_count % self.capacity
+        Profiler.record(self.timings, self.frame_timings, slot, self.capacity, 1000)
+        Profiler.record(self.counters, self.frame_counters, slot, self.capacity, 1)
+        self.frame_timings.clear()
+        self.frame_counters.clear()
+        self.frame_count += 1
+
+    def record(buffers : Dict[str, np.ndarray], values : Dict, slot : int, capacity : int, scale : float):
+        for name in values:
+            if name not in buffers:
+                buffers[name] = np.zeros(capacity)
+        #Phases and counters that did not come up this frame are recorded as 0
+        for name, buffer in buffers.items():
+            buffer[slot] = values.get(name, 0) * scale
+
+    def start(self, name : str):
+        if not self.is_enabled:
+            return
+        self.phase_starts[name] = time.perf_counter()
+
+    def stop(self, name : str):
+        '''Adds the time since start was called for a phase to the frame, a phase can be timed more than once a frame.'''
+        if not self.is_enabled or name not in self.phase_starts:
+            return
+        self.frame_timings[name] = self.frame_timings.get(name, 0) + time.perf_counter() - self.phase_starts.pop(name)
+
+    def phase(self, name : str) -> "Profiler.Phase":
+        return Profiler.Phase(self, name)
+
+    def count(self, name : str, amount : int = 1):
+        if not self.is_enabled:
+            return
+        self.frame_counters[name] = self.frame_counters.get(name, 0) + amount
+
+    def reset(self):
+        self.timings.clear()
+        self.counters.clear()
+        self.frame_count = 0
+
+    def get_names(self) -> List[str]:
+        return list(self.timings.keys()) + list(self.counters.keys())
+
+    def get_samples(self, name : str) -> np.ndarray:
+        '''Returns the recorded values of a phase or counter, oldest first.'''
+        buffer = self.timings.get(name)
+        if buffer is None:
+            buffer = self.counters.get(name)
+        if buffer is None:
+            return np.zeros(0)
+        if self.frame_count <= self.capacity:
+            return buffer[:self.frame_count]
+        return np.roll(buffer, -(self.frame_count % self.capacity))
+
+    def percentile(self, name : str, percent : float) -> float:
+        samples = self.get_samples(name)
+        if len(samples) == 0:
+            return 0.0
+        return float(np.percentile(samples, percent))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        '''Returns the mean, median, 95th, 99th percentile and max of every phase and counter.'''
+        result : Dict[str, Dict[str, float]] = {}
+        for name in self.get_names():
+            samples = self.get_samples(name)
+            if len(samples) == 0:
+                continue
+            p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+            result[name] = {"mean" : float(samples.mean()), "p50" : float(p50), "p95" : float(p95),
+                            "p99" : float(p99), "max" : float(samples.max())}
+        return result
+
+    def export_csv(self, path : str):
+        '''Writes one row per recorded frame with a column for every phase (in ms) and counter.'''
+        names = self.get_names()
+        columns = [self.get_samples(name) for name in names]
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame"] + names)
+            first_frame = self.frame_count - len(columns[0]) if len(columns) > 0 else 0
+            for row in range(len(columns[0]) if len(columns) > 0 else 0):
+                writer.writerow([first_frame + row] + [column[row] for column in columns])
+
+    def export_json(self, path : str):
+        '''Writes the summary along with every recorded sample.'''
+        data = {"frames" : min(self.frame_count, self.capacity),
+                "summary" : self.summary(),
+                "timings" : {name : self.get_samples(name).tolist() for name in self.timings},
+                "counters" : {name : self.get_samples(name).tolist() for name in self.counters}}
+        with open(path, "w") as file:
+            json.dump(data, file, indent=4)
+
+    def export(self, path : str):
+        '''Exports to csv or json depending on the extension of path.'''
+        if path.endswith(".csv"):
+            self.export_csv(path)
+        else:
+            self.export_json(path)
+
+    def draw_overlay(self, camera : "Camera", interval : float = 0.5):
+        '''Puts a table of the median and 95th percentile of each phase and counter in the top left of the screen.
+        The text is only rendered again every interval seconds, so the overlay itself barely shows up in it.'''
+        if not self.is_enabled:
+            return
+        now = time.perf_counter()
+        if self.overlay == None or now - self.overlay_time >= interval:
+            self.overlay_time = now
+            if self.font == None:
+                self.font = pygame.font.Font(None, 16)
+            rows = [("", "p50", "p95")]
+            for name, stats in self.summary().items():
+                unit = " ms" if name in self.timings else ""
+                rows.append((name, "%.2f%s" % (stats["p50"], unit), "%.2f%s" % (stats["p95"], unit)))
+            #Each cell is rendered on its own so the columns line up, the numbers are right aligned
+            rendered = [[self.font.render(cell, True, (255, 255, 255)) for cell in row] for row in rows]
+            widths = [max(row[column].get_width() for row in rendered) + 8 for column in range(3)]
+            line_height = self.font.get_linesize()
+            self.overlay = Surface((sum(widths) + 8, line_height * len(rows) + 8), pygame.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 160))
+            for index, row in enumerate(rendered):
+                y = 4 + index * line_height
+                self.overlay.blit(row[0], (4, y))
+                self.overlay.blit(row[1], (4 + widths[0] + widths[1] - row[1].get_width(), y))
+                self.overlay.blit(row[2], (4 + sum(widths) - row[2].get_width(), y))
+            self.count("surfaces", len(rows) * 3 + 1)
+        #Drawn in screen space, so the table stays readable however far the camera is zoomed out
+        camera.add_to_screen(self.overlay, 0, 0)
+
+Profiler.shared = Profiler()
@@ -0,0 +1,90 @@
+from typing import List, Tuple
+import pygame, struct, gzip, zlib
+
+class InputRecorder:
+    '''Writes the delta and input events of every frame to a file, so a session can be played back exactly with
+    InputReplay. Only the events the game reacts to are kept, each packed into a fixed size record and the
+    whole file gzipped, so an idle frame costs a few bytes.'''
+    MAGIC = b"IMRC"
+    VERSION = 1
+    #Magic, version and the scale of the window the mouse positions are relative to
+    HEADER = struct.Struct("<4sHH")
+    #Delta and the number of events that follow
+    FRAME = struct.Struct("<dH")
+    #Type, key, button and mouse position
+    EVENT = struct.Struct("<Iiiii")
+    EVENT_TYPES = (pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP, pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)
+    #Frames between flushes, a session that crashes loses at most this many frames
+    FLUSH_FRAMES = 60
+
+    def __init__(self, path : str, scale : int = 1):
+        self.path = path
+        self.file = gzip.open(path, "wb")
+        self.file.write(InputRecorder.HEADER.pack(InputRecorder.MAGIC, InputRecorder.VERSION, scale))
+        self.frame_count = 0
+
+    def record(self, delta : float, events : List[pygame.event.Event]):
+        events = [event for event in events if event.type in InputRecorder.EVENT_TYPES]
+        self.file.write(InputRecorder.FRAME.pack(delta, len(events)))
+        for event in events:
+            pos = getattr(event, "pos", (0, 0))
+            self.file.write(InputRecorder.EVENT.pack(event.type, getattr(event, "key", 0), getattr(event, "button", 0),
+                                                     int(pos[0]), int(pos[1])))
+        self.frame_count += 1
+        if self.frame_count % InputRecorder.FLUSH_FRAMES == 0:
+            #Ends the compressed block so far, it can be read back even if the file is never closed
+            self.file.flush()
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+class InputReplay:
+    '''Plays back a file written by InputRecorder one frame at a time. The whole file is read up front,
+    so playing it back costs no more than unpacking the frames. A recording cut off by a crash plays
+    back up to the last frame that was saved whole.'''
+    def __init__(self, path : str):
+        self.path = path
+        self.data = InputReplay.read_data(path)
+        if len(self.data) < InputRecorder.HEADER.size:
+            raise ValueError("Not an input recording, or one cut off before anything was saved: " + path)
+        magic, version, self.scale = InputRecorder.HEADER.unpack_from(self.data, 0)
+        if magic != InputRecorder.MAGIC or version != InputRecorder.VERSION:
+            raise ValueError("Not an input recording, or one from another version: " + path)
+        self.offset = InputRecorder.HEADER.size
+        self.frame_count = 0
+
+    def read_data(path : str) -> bytes:
+        '''Returns everything that can be decompressed from a recording, stopping where it was cut off if it was.'''
+        with open(path, "rb") as file:
+            compressed = file.read()
+        #gzip raises on a stream that was never closed and throws away what it had, zlib hands back all it could decompress
+        return zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(compressed)
+
+    def read_frame(self) -> Tuple[float, List[pygame.event.Event]]:
+        '''Returns the delta and events of the next frame, or None once the recording has ended.'''
+        if self.offset + InputRecorder.FRAME.size > len(self.data):
+            return None
+        delta, event_count = InputRecorder.FRAME.unpack_from(self.data, self.offset)
+        #A frame cut off part way through its events is left out
+        if self.offset + InputRecorder.FRAME.size + event_count * InputRecorder.EVENT.size > len(self.data):
+            self.offset = len(self.data)
+            return None
+        self.offset += InputRecorder.FRAME.size
+        events : List[pygame.event.Event] = []
+        for i in range(event_count):
+            type, key, button, x, y = InputRecorder.EVENT.unpack_from(self.data, self.offset)
+            self.offset += InputRecorder.EVENT.size
+            events.append(InputReplay.make_event(type, key, button, (x, y)))
+        self.frame_count += 1
+        return delta, events
+
+    def make_event(type : int, key : int, button : int, pos : Tuple[int, int]) -> pygame.event.Event:
+        if type == pygame.KEYDOWN or type == pygame.KEYUP:
+            return pygame.event.Event(type, key=key)
+        if type == pygame.MOUSEBUTTONDOWN or type == pygame.MOUSEBUTTONUP:
+            return pygame.event.Event(type, button=button, pos=pos)
+        if type == pygame.MOUSEMOTION:
+            return pygame.event.Event(type, pos=pos)
+        return pygame.event.Event(type)
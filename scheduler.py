@@ -0,0 +1,86 @@
+from typing import Generator, List, Tuple
+from profiler import Profiler
+import heapq, itertools, time, traceback
+
+class Scheduler:
+    '''Runs background work a step at a time so it is spread over frames rather than all landing in one.
+    A job is a generator that yields whenever it has done a small piece of its work. Every frame, run steps
+    the jobs, highest priority first, until its time budget is used up. Jobs left over carry on the next frame.'''
+    shared : "Scheduler" = None
+
+    #Higher priorities are stepped first, jobs of the same priority take turns a step at a time
+    SAVE_PRIORITY = -1
+    LOAD_PRIORITY = 0
+    BAKE_PRIORITY = 1
+
+    class Job:
+        def __init__(self, task : Generator, priority : int):
+            self.task = task
+            self.priority = priority
+            self.is_done = False
+            #Set if the job stopped on an exception rather than finishing
+            self.has_failed = False
+
+        def cancel(self):
+            '''Stops the job where it is by closing its generator. Finally blocks in it only run if it had started,
+            a job cancelled before its first step never runs any of its code, so whatever owns it has to forget it.'''
+            if self.is_done:
+                return
+            self.is_done = True
+            self.task.close()
+
+    def __init__(self):
+        self.queue : List[Tuple[int, int, Scheduler.Job]] = []
+        self.counter = itertools.count()
+
+    def add(self, task : Generator, priority : int = 0) -> "Scheduler.Job":
+        job = Scheduler.Job(task, priority)
+        self.push(job)
+        return job
+
+    def push(self, job : "Scheduler.Job"):
+        #The counter keeps jobs of the same priority in the order they were queued
+        heapq.heappush(self.queue, (-job.priority, next(self.counter), job))
+
+    def step(self, job : "Scheduler.Job") -> bool:
+        '''Runs one step of a job, returns False once it has finished. A job that raises an exception is reported
+        and dropped, so one failed bake or load does not stop the game.'''
+        try:
+            next(job.task)
+            return True
+        except StopIteration:
+            job.is_done = True
+            return False
+        except Exception:
+            job.is_done = True
+            job.has_failed = True
+            print("Err in background job:")
+            traceback.print_exc()
+            return False
+
+    def run(self, budget : float):
+        '''Steps jobs until budget seconds have passed. At least one step is always run, so a slow frame
+        can hold background work up but never stop it.'''
+        deadline = time.perf_counter() + budget
+        steps = 0
+        while len(self.queue) > 0:
+            if steps > 0 and time.perf_counter() >= deadline:
+                break
+            job : Scheduler.Job = heapq.heappop(self.queue)[2]
+            if job.is_done:
+                continue #Cancelled or finished early
+            steps += 1
+            if self.step(job):
+                self.push(job)
+        Profiler.shared.count("job_steps", steps)
+
+    def finish(self, job : "Scheduler.Job"):
+        '''Runs the rest of a job now, for when its result is needed before the scheduler would get to it.'''
+        while not job.is_done and self.step(job):
+            pass
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for entry in self.queue if not entry[2].is_done)
+
+Scheduler.shared = Scheduler()
@@ -1,37 +1,171 @@
-from pygame import Surface, SRCALPHA, transform, image
+import os, json
+from pygame import Surface, Rect, SRCALPHA, transform
 from vector import Vector2
 from typing import Dict, List
-from camera import Camera
+import numpy as np
+from camera import Camera, Drawable
+from assets import AssetManager, Asset
+from profiler import Profiler
+from scheduler import Scheduler
 
 class Animation:
-    def load_animation(path : str, frame_width : int, frame_height : int, frame_count : int):
-        frames : List[Surface] = []
+    def load_frame_rects(path : str) -> List[Rect]:
+        '''Reads the frame rects of an atlas from the sidecar file next to it, a json list of [x, y, width, height]
+        with the same name as the atlas (Images/KarenWalk.png -> Images/KarenWalk.json). Returns None if there is none.'''
+        sidecar_path = os.path.splitext(path)[0] + ".json"
+        if not os.path.isfile(sidecar_path):
+            return None
         try:
-            atlas : Surface = image.load(path).convert_alpha()
+            with open(sidecar_path) as file:
+                return [Rect(rect) for rect in json.load(file)]
         except:
+            print("Err loading frame rects from path: " + sidecar_path)
+            return None
+
+    def get_grid_rects(atlas_width : int, atlas_height : int, frame_width : int, frame_height : int, frame_count : int) -> List[Rect]:
+        '''Returns the rects of the first frame_count cells of an atlas, read left to right then top to bottom.'''
+        rects : List[Rect] = []
+        for y in range(atlas_height // frame_height):
+            for x in range(atlas_width // frame_width):
+                if len(rects) >= frame_count:
+                    return rects
+                rects.append(Rect(x * frame_width, y * frame_height, frame_width, frame_height))
+        return rects
+
+    def load_animation(atlas : Surface, path : str, frame_width : int, frame_height : int, frame_count : int, share_atlas : bool = True):
+        '''Cuts the frames of an animation out of its atlas, loaded from path. With share_atlas the frames are subsurfaces of
+        the atlas, so they use its pixels rather than a copy of their own, otherwise each frame is copied out to its own surface.'''
+        frames : List[Surface] = []
+        if atlas == None:
             print("Err loading animation atlas from path: " + path)
             return None
-        
-        counter = 0
-        for y in range(atlas.get_height() // frame_height):
-            for x in range(atlas.get_width() // frame_width):
-                if counter > frame_count:
-                    return frames
-                frame = Surface((frame_width, frame_height), SRCALPHA).convert_alpha()
-                frame.blit(atlas, (0, 0), (x * frame_width, y * frame_height, frame_width, frame_height))
-                frames.append(frame)
-                counter += 1
+
+        rects = Animation.load_frame_rects(path)
+        if rects == None:
+            rects = Animation.get_grid_rects(atlas.get_width(), atlas.get_height(), frame_width, frame_height, frame_count)
+        for rect in rects:
+            if share_atlas:
+                frames.append(atlas.subsurface(rect))
+                continue
+            frame = Surface(rect.size, SRCALPHA).convert_alpha()
+            frame.blit(atlas, (0, 0), rect)
+            frames.append(frame)
+            Profiler.shared.count("surfaces")
         return frames
 
-    def __init__(self, atlas_path : str, frame_width : int, frame_height : int, frame_count : int, framerate = 12.0, is_looping = True):
-        self.frames : List[Surface] = Animation.load_animation(atlas_path, frame_width, frame_height, frame_count)
+    def __init__(self, atlas_path : str, frame_width : int, frame_height : int, frame_count : int, framerate = 12.0, is_looping = True, share_atlas = True):
+        self.atlas_path = atlas_path
+        self.max_frames = frame_count
         self.framerate = framerate
-        self.frame_count = 0
         self.frame_width = frame_width
         self.frame_height = frame_height
         self.is_looping = is_looping
-        if self.frames != None:
-            self.frame_count = len(self.frames)
+        self.share_atlas = share_atlas
+        self.is_loaded = False
+        #The atlas is held from the asset manager for as long as the frames are loaded, if they share its pixels
+        self.atlas : Asset = None
+        self.loaded_frames : List[Surface] = None
+        self.flipped_frames : List[Surface] = None
+        self.load_job : Scheduler.Job = None
+        #The number of frames the animation is expected to have before it is loaded, see expected_frame_count
+        self.expected_count : int = None
+
+    @property
+    def frames(self) -> List[Surface]:
+        '''The frames of the animation, loaded from the atlas the first time they are needed.'''
+        if not self.is_loaded:
+            if self.load_job != None:
+                #A job that never started has no finally to clear it
+                self.load_job.cancel()
+                self.load_job = None
+            self.load(AssetManager.shared.acquire(self.atlas_path))
+        return self.loaded_frames
+
+    def load(self, atlas : Asset):
+        '''Cuts the frames out of an atlas acquired from the asset manager, which is kept if they share its pixels.'''
+        self.atlas = atlas
+        self.loaded_frames = Animation.load_animation(atlas.get(), self.atlas_path, self.frame_width, self.frame_height, self.max_frames, self.share_atlas)
+        if not self.share_atlas:
+            self.atlas.release()
+            self.atlas = None
+        self.is_loaded = True
+
+    def preload(self, flip_x : bool = False):
+        '''Loads the animation through the scheduler so the first frame drawn does not have to wait on it,
+        along with its mirrored frames if flip_x is set.'''
+        if (not self.is_loaded or (flip_x and self.flipped_frames == None)) and self.load_job == None:
+            self.load_job = Scheduler.shared.add(self.load_steps(flip_x), Scheduler.LOAD_PRIORITY)
+
+    def load_steps(self, flip_x : bool = False, frames_per_step : int = 4):
+        '''Waits for the asset manager's loader thread to decode the atlas, then cuts the frames out of it.
+        Mirrored frames are made frames_per_step at a time.'''
+        if not self.is_loaded:
+            atlas = AssetManager.shared.acquire(self.atlas_path)
+            try:
+                while not atlas.is_ready.is_set():
+                    yield
+            except BaseException:
+                #Cancelled or failed while waiting, closing the generator raises GeneratorExit here
+                atlas.release()
+                self.load_job = None
+                raise
+            self.load(atlas)
+        try:
+            if flip_x and self.flipped_frames == None and self.loaded_frames != None:
+                flipped_frames : List[Surface] = []
+                for start in range(0, len(self.loaded_frames), frames_per_step):
+                    yield
+                    flipped_frames += [transform.flip(frame, True, False) for frame in self.loaded_frames[start:start + frames_per_step]]
+                    Profiler.shared.count("surfaces", len(flipped_frames) - start)
+                self.flipped_frames = flipped_frames
+        finally:
+            self.load_job = None
+
+    def unload(self):
+        '''Drops the frames and gives the atlas back to the asset manager. They are loaded again if they are needed.'''
+        self.loaded_frames = None
+        self.flipped_frames = None
+        self.is_loaded = False
+        if self.atlas != None:
+            self.atlas.release()
+            self.atlas = None
+
+    def get_frames(self, flip_x : bool = False) -> List[Surface]:
+        '''Returns the frames of the animation, mirrored horizontally if flip_x is set. The mirrored frames
+        are only made the first time they are asked for.'''
+        if not flip_x or self.frames == None:
+            return self.frames
+        if self.flipped_frames == None:
+            self.flipped_frames = [transform.flip(frame, True, False) for frame in self.frames]
+            Profiler.shared.count("surfaces", len(self.flipped_frames))
+        return self.flipped_frames
+
+    @property
+    def frame_count(self) -> int:
+        if self.frames == None:
+            return 0
+        return len(self.frames)
+
+    @property
+    def expected_frame_count(self) -> int:
+        '''The number of frames the animation has, worked out without loading them if they are not loaded yet. That is
+        the number of rects in the sidecar file if there is one, otherwise the frame count it was made with, which
+        can be more than the atlas holds.'''
+        if self.is_loaded:
+            return self.frame_count
+        if self.expected_count == None:
+            rects = Animation.load_frame_rects(self.atlas_path)
+            self.expected_count = self.max_frames if rects == None else len(rects)
+        return self.expected_count
+
+    def get_memory_usage(self) -> int:
+        '''Returns the bytes of pixel data held by the loaded frames. Frames sharing the atlas count it once.'''
+        if not self.is_loaded:
+            return 0
+        size = AssetManager.get_surface_bytes(self.atlas.surface) if self.atlas != None else 0
+        for frame in self.loaded_frames + (self.flipped_frames if self.flipped_frames != None else []):
+            size += AssetManager.get_surface_bytes(frame)
+        return size
 
 class Sprite:
     animations : Dict[str, Animation] = {}
@@ -45,63 +179,254 @@ class Sprite:
         self.animation : Animation = None
         self.frame : int = 0
         self.timer = 0.0
+        #While a sprite is in an AnimationSystem its frame, timer and is_playing are kept there, and only read back here when drawn
+        self.animation_system : AnimationSystem = None
+        self.animation_slot : int = -1
+        self.drawable : Drawable = None
+        #The mirrored copy of a surface that is not an animation frame, and the surface it was made from
+        self.flipped_surface : Surface = None
+        self.flipped_source : Surface = None
     
-    def add_animation(self, name : str, atlas_path : str, frame_width : int, frame_height : int, frame_count : int, framerate = 12.0, is_looping = True):
+    def add_animation(self, name : str, atlas_path : str, frame_width : int, frame_height : int, frame_count : int, framerate = 12.0, is_looping = True, share_atlas = True):
         if name in Sprite.animations:
             print(name + " is already an animation!")
             return
-        Sprite.animations[name] = (Animation(atlas_path, frame_width, frame_height, frame_count, framerate, is_looping))
+        Sprite.animations[name] = (Animation(atlas_path, frame_width, frame_height, frame_count, framerate, is_looping, share_atlas))
+
+    def get_memory_usage() -> int:
+        '''Returns the bytes of pixel data held by every loaded animation.'''
+        return sum(animation.get_memory_usage() for animation in Sprite.animations.values())
+
+    def remove_animation(name : str):
+        '''Unloads an animation and forgets its name, letting its atlas be evicted. Sprites still playing it load it again when drawn.'''
+        animation = Sprite.animations.pop(name, None)
+        if animation != None:
+            animation.unload()
+
+    def read_animation(self):
+        if self.animation_system != None:
+            self.animation_system.read(self)
+
+    def write_animation(self):
+        if self.animation_system != None:
+            self.animation_system.write(self)
 
     def play(self, name : str = ""):
+        self.read_animation()
         if name == "":
             self.is_playing = True
-            return
-        if name not in Sprite.animations:
+        elif name not in Sprite.animations:
             self.is_playing = False
             print("Animation " + name + " does not exist!")
-            return
-        self.animation = Sprite.animations[name]
-        self.frame = 0
-        self.is_playing = True
+        else:
+            self.animation = Sprite.animations[name]
+            self.frame = 0
+            self.timer = 0.0
+            self.is_playing = True
+        self.write_animation()
 
     def increment_frame(self):
         '''Increment the frame of the animation, upon reaching the end, it will loop back to the beginning
         if is_loop is true. Otherwise, it will set the current frame the last frame.'''
         if self.animation.frame_count == 0:
             return
+        self.read_animation()
         self.frame += 1
         if self.animation.is_looping:
             self.frame = self.frame % self.animation.frame_count
         elif self.frame > self.animation.frame_count - 1:
             self.frame = self.animation.frame_count - 1
             self.is_playing = False
+        self.write_animation()
     
     def set_frame(self, new_frame : int) -> int:
         '''Sets the frame of the animation to new_frame clamped between 0 and the frame count.'''
+        self.read_animation()
         self.frame = new_frame
         if self.frame > self.animation.frame_count - 1:
             self.frame = self.animation.frame_count - 1
         elif self.frame < 0:
             self.frame = 0
+        self.write_animation()
     
-    def get_frame(self) -> Surface:
+    def get_frame(self, flip_x : bool = False) -> Surface:
         if self.frame >= 0 and self.frame < self.animation.frame_count:
-            return self.animation.frames[self.frame]
+            return self.animation.get_frames(flip_x)[self.frame]
         return None
 
+    def get_flipped_surface(self) -> Surface:
+        '''Returns the sprite's surface mirrored horizontally, only flipping it again if the surface has changed.'''
+        if self.surface == None:
+            return None
+        if self.flipped_source is not self.surface:
+            self.flipped_surface = transform.flip(self.surface, True, False)
+            Profiler.shared.count("surfaces")
+            self.flipped_source = self.surface
+        return self.flipped_surface
+
     def stop(self):
+        self.read_animation()
         self.is_playing = False
+        self.write_animation()
 
-    def draw(self, camera : Camera, delta : float):
-        if self.is_playing and self.animation != None:
+    def update(self, delta : float):
+        '''Advances the animation by delta seconds, keeping whatever time is left over towards the next frame.
+        Sprites in an AnimationSystem are advanced by it instead.'''
+        if self.animation_system != None or not self.is_playing or self.animation == None:
+            return
+        self.timer += delta
+        frame_time = 1 / self.animation.framerate
+        while self.timer >= frame_time and self.is_playing:
+            self.timer -= frame_time
+            self.increment_frame()
+        if not self.is_playing:
+            self.timer = 0.0
+
+    def remove(self):
+        '''Takes the sprite off the camera it was last drawn to.'''
+        if self.drawable != None:
+            self.drawable.remove()
+            self.drawable = None
+
+    def draw(self, camera : Camera):
+        was_playing = self.is_playing
+        if self.animation_system != None:
+            #Out of view the drawable keeps its old frame, it is only brought up to date once it can be seen again
+            if (self.drawable != None and self.drawable.camera is camera and self.drawable.surface != None and
+                not camera.is_visible(self.drawable.surface, self.position.x, self.position.y)):
+                self.drawable.set_position(self.position.x, self.position.y)
+                return
+            self.animation_system.read(self)
+        #A sprite that was playing when last drawn shows the frame it finished on, even if it stopped since
+        if (self.is_playing or was_playing) and self.animation != None:
             self.surface = self.get_frame()
-            self.timer += delta
-            if self.timer > 1/self.animation.framerate:
-                self.timer = 0
-                self.increment_frame()
+            draw_surface = self.get_frame(self.flip_x)
+        elif self.flip_x:
+            draw_surface = self.get_flipped_surface()
+        else:
+            draw_surface = self.surface
         if self.surface == None:
+            if self.drawable != None:
+                self.drawable.set_visible(False)
             return
-        draw_surface = self.surface
-        if self.flip_x:
-            draw_surface = transform.flip(draw_surface, self.flip_x, False)
-        camera.add_to_sorted(draw_surface, self.position.x, self.position.y, self.y_offset)
\ No newline at end of file
+        #The sprite stays on the camera between frames, so only what changed is updated
+        if self.drawable == None or self.drawable.camera is not camera:
+            self.drawable = camera.add_retained(Camera.SORTED, draw_surface, self.position.x, self.position.y, self.y_offset)
+            return
+        self.drawable.set_surface(draw_surface)
+        self.drawable.set_position(self.position.x, self.position.y)
+        self.drawable.set_y_offset(self.y_offset)
+        self.drawable.set_visible(True)
+
+class AnimationSystem:
+    '''Advances the animations of many sprites at once. The timer, frame and animation settings of each sprite
+    are kept in arrays, so a frame costs a handful of array operations however many sprites there are.
+    Animations are never loaded by the system, sprites playing one that is not loaded yet use the frame count
+    it is expected to have until it is.'''
+    def __init__(self, capacity : int = 64):
+        self.sprites : List[Sprite] = []
+        #Sprites whose frame count is only expected, it is written again once their animation has loaded
+        self.unloaded : Dict[Sprite, None] = {}
+        self.timers = np.zeros(capacity)
+        self.frame_times = np.ones(capacity)
+        self.frames = np.zeros(capacity, dtype=np.int64)
+        self.frame_counts = np.ones(capacity, dtype=np.int64)
+        self.is_looping = np.zeros(capacity, dtype=bool)
+        self.is_playing = np.zeros(capacity, dtype=bool)
+
+    def grow(self):
+        '''Doubles the capacity of the arrays.'''
+        capacity = len(self.timers)
+        self.timers = np.concatenate((self.timers, np.zeros(capacity)))
+        self.frame_times = np.concatenate((self.frame_times, np.ones(capacity)))
+        self.frames = np.concatenate((self.frames, np.zeros(capacity, dtype=np.int64)))
+        self.frame_counts = np.concatenate((self.frame_counts, np.ones(capacity, dtype=np.int64)))
+        self.is_looping = np.concatenate((self.is_looping, np.zeros(capacity, dtype=bool)))
+        self.is_playing = np.concatenate((self.is_playing, np.zeros(capacity, dtype=bool)))
+
+    def add(self, sprite : Sprite):
+        if sprite.animation_system is self:
+            return
+        if sprite.animation_system != None:
+            sprite.animation_system.remove(sprite)
+        if len(self.sprites) == len(self.timers):
+            self.grow()
+        sprite.animation_system = self
+        sprite.animation_slot = len(self.sprites)
+        self.sprites.append(sprite)
+        self.write(sprite)
+
+    def remove(self, sprite : Sprite):
+        '''Hands a sprite's animation back to it. The last sprite is moved into its slot to keep the arrays packed.'''
+        if sprite.animation_system is not self:
+            return
+        self.read(sprite)
+        slot = sprite.animation_slot
+        last = len(self.sprites) - 1
+        if slot != last:
+            moved = self.sprites[last]
+            for array in (self.timers, self.frame_times, self.frames, self.frame_counts, self.is_looping, self.is_playing):
+                array[slot] = array[last]
+            self.sprites[slot] = moved
+            moved.animation_slot = slot
+        self.sprites.pop()
+        self.unloaded.pop(sprite, None)
+        sprite.animation_system = None
+        sprite.animation_slot = -1
+
+    def write(self, sprite : Sprite):
+        '''Copies a sprite's animation state into the arrays.'''
+        slot = sprite.animation_slot
+        self.timers[slot] = sprite.timer
+        self.frames[slot] = sprite.frame
+        self.is_playing[slot] = sprite.is_playing and sprite.animation != None
+        if sprite.animation != None:
+            #Animations that failed to load have no frames, a count of 1 keeps them on frame 0
+            self.frame_counts[slot] = max(sprite.animation.expected_frame_count, 1)
+            self.frame_times[slot] = 1 / sprite.animation.framerate
+            self.is_looping[slot] = sprite.animation.is_looping
+            if sprite.animation.is_loaded:
+                self.unloaded.pop(sprite, None)
+            else:
+                self.unloaded[sprite] = None
+
+    def read(self, sprite : Sprite):
+        '''Copies a sprite's animation state out of the arrays.'''
+        slot = sprite.animation_slot
+        sprite.timer = float(self.timers[slot])
+        sprite.frame = int(self.frames[slot])
+        if sprite.animation != None:
+            sprite.is_playing = bool(self.is_playing[slot])
+
+    def update(self, delta : float):
+        '''Advances every playing animation by delta seconds, keeping whatever time is left over towards the next frame.'''
+        count = len(self.sprites)
+        if count == 0:
+            return
+        if len(self.unloaded) > 0:
+            for sprite in [sprite for sprite in self.unloaded if sprite.animation == None or sprite.animation.is_loaded]:
+                self.unloaded.pop(sprite)
+                if sprite.animation != None:
+                    #The frame the sprite is on may be past the end if it had fewer frames than expected
+                    slot = sprite.animation_slot
+                    frame_count = max(sprite.animation.frame_count, 1)
+                    self.frame_counts[slot] = frame_count
+                    if self.frames[slot] >= frame_count:
+                        self.frames[slot] = self.frames[slot] % frame_count if self.is_looping[slot] else frame_count - 1
+        timers = self.timers[:count]
+        frame_times = self.frame_times[:count]
+        frames = self.frames[:count]
+        frame_counts = self.frame_counts[:count]
+        is_looping = self.is_looping[:count]
+        is_playing = self.is_playing[:count]
+
+        np.add(timers, delta, out=timers, where=is_playing)
+        steps = np.floor_divide(timers, frame_times, out=np.zeros(count), where=is_playing)
+        np.remainder(timers, frame_times, out=timers, where=is_playing)
+        frames += steps.astype(np.int64)
+        np.remainder(frames, frame_counts, out=frames, where=is_looping)
+        #Animations that do not loop stop on their last frame, once they have tried to go past it
+        finished = is_playing & ~is_looping & (frames >= frame_counts)
+        frames[finished] = frame_counts[finished] - 1
+        timers[finished] = 0
+        is_playing[finished] = False
\ No newline at end of file
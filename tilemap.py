@@ -1,8 +1,11 @@
 from pygame import Surface, Rect
-from typing import List, Dict, Set
-from vector import Vector2
-from camera import Camera
-import pygame, os
+from typing import List, Dict, Set, Tuple
+from vector import Vector2, Vector2i
+from camera import Camera, Drawable
+from assets import AssetManager
+from profiler import Profiler
+from scheduler import Scheduler
+import pygame, os, struct, math
 
 class Tilemap:
     TILE_BITMAPS : Dict[int, int] = {
@@ -12,41 +15,339 @@ class Tilemap:
         0x0 : 12, 0x8 : 13, 0x6 : 14, 0x1 : 15
     }
 
+    def read_image_size(path : str) -> Tuple[int, int]:
+        '''Returns the size of an image file. PNGs only have their header read, so no pixels are decoded.'''
+        with open(path, "rb") as file:
+            header = file.read(24)
+        if header[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", header[16:24])
+        return pygame.image.load(path).get_size()
+
     def load_tile_types(tile_size):
         image_files = os.listdir("Images/Tiles")
         counter = 0
         for image_file_name in image_files:
             has_collision : bool = False
             name = image_file_name.replace(".png", "")
-            image_file = pygame.image.load("Images/Tiles/" + image_file_name).convert_alpha()
-            if image_file.get_height() // 4 != tile_size:
+            path = "Images/Tiles/" + image_file_name
+            image_size = Tilemap.read_image_size(path)
+            if image_size[1] // 4 != tile_size:
                 has_collision = True
-            tile_type = Tilemap.Tile(image_file, name, has_collision)
+            tile_type = Tilemap.Tile(path, name, has_collision, image_size[1] // 4)
             Tilemap.tile_types[counter] = tile_type
             counter += 1
 
+    def is_surface_opaque(surface : Surface) -> bool:
+        if surface.get_flags() & pygame.SRCALPHA == 0:
+            return True
+        return bool(pygame.surfarray.array_alpha(surface).min() == 255)
+
     def slice_tile_texture(source : Surface):
         variations : List[Surface] = []
+        for step in Tilemap.slice_tile_steps(source, variations):
+            pass
+        return variations
+
+    def slice_tile_steps(source : Surface, variations : List[Surface]):
+        '''Cuts the 16 variations out of a tile's source image into variations, yielding after each row of 4.'''
         tile_size = [source.width // 4, source.height // 4]
         for y in range(4):
+            if y > 0:
+                yield
             for x in range(4):
                 variation = Surface((tile_size[0], tile_size[1]), pygame.SRCALPHA).convert_alpha()
                 variation.blit(source, (0, 0), Rect(x * tile_size[0], y * tile_size[1], tile_size[0], tile_size[1])) 
                 variations.append(variation)
-        return variations
+            Profiler.shared.count("surfaces", 4)
     
     class Chunk:
+        '''The tiles of a chunk as a list of blits. The surface is only baked from them once something draws it.'''
         def __init__(self, width : int, height : int, tile_width : int, tile_height : int):
-            self.surface : Surface = Surface((width * tile_width, height * tile_height), pygame.SRCALPHA).convert_alpha()
             self.width = width
             self.height = height
+            self.pixel_width = width * tile_width
+            self.pixel_height = height * tile_height
+            self.fill_color = (0, 0, 0, 0)
+            #(tile type, variation, destination, area) for every tile texture in the chunk
+            self.blits : List[Tuple[int, int, Tuple[int, int], Rect]] = []
             self.is_empty : bool = True
+            self.is_dirty : bool = True
+            self.baked_surface : Surface = None
+            #Goes up every time the tiles change, so a bake spread over frames can tell if it went out of date
+            self.version = 0
+            self.bake_job : Scheduler.Job = None
+            #Goes up with every finished bake, surfaces can be baked again in place so this is how a drawable tells
+            self.bake_count = 0
+            self.drawn_bake_count = -1
+            #The baked surface scaled down for zoomed out cameras, each level half the size of the one before, see get_level
+            self.levels : List[Surface] = []
+            #The retained drawable of the camera the chunk was last drawn to
+            self.drawable : Drawable = None
+
+        @property
+        def surface(self) -> Surface:
+            '''The image of the chunk, rebaked on access if its tiles have changed since the last bake. While a bake
+            is under way in the scheduler the last image is returned instead, as long as it is still the right size.'''
+            if self.is_dirty:
+                if (self.bake_job == None or self.baked_surface == None or
+                    self.baked_surface.get_size() != (self.pixel_width, self.pixel_height)):
+                    self.bake()
+            return self.baked_surface
+
+        def clear(self):
+            self.blits.clear()
+            self.fill_color = (0, 0, 0, 0)
+            self.is_empty = True
+            self.is_dirty = True
+            self.version += 1
+
+        def add_blit(self, tile_type : int, variation : int, dest : Tuple[int, int], area : Rect = None):
+            self.blits.append((tile_type, variation, dest, area))
+            self.is_empty = False
+
+        def bake(self):
+            '''Bakes the chunk now, taking over from any bake the scheduler had under way.'''
+            self.cancel_bake()
+            for step in self.bake_steps(in_place=True):
+                pass
+
+        def is_opaque(self, blits : List[Tuple[int, int, Tuple[int, int], Rect]]) -> bool:
+            '''Returns whether every tile of the chunk is covered by a fully opaque texture, which is only ever true
+            of floors. Textures that only cover part of a tile are not added up, so this can miss some.'''
+            tile_height = self.pixel_height // self.height
+            covered = {dest for tile_type, variation, dest, area in blits
+                       if area == None and Tilemap.tile_types[tile_type].height == tile_height and
+                       Tilemap.tile_types[tile_type].opaque_variations[variation]}
+            return len(covered) >= self.width * self.height
+
+        def bake_steps(self, tiles_per_step : int = 16, in_place : bool = False):
+            '''Bakes the chunk tiles_per_step tiles at a time, yielding in between. A tile can take several textures,
+            so the chunk's blits are split evenly over the steps its tiles take. The old image is kept until the
+            new one is whole, unless it all fits in one step or in_place is set, then the old surface is baked
+            over if it is the same size and format. Opaque chunks are baked without alpha, so they are drawn as
+            straight copies.'''
+            version = self.version
+            blits = list(self.blits)
+            step_count = math.ceil(self.width * self.height / tiles_per_step)
+            blits_per_step = max(1, math.ceil(len(blits) / step_count))
+            is_opaque = self.is_opaque(blits)
+            surface = self.baked_surface
+            if (surface == None or surface.get_size() != (self.pixel_width, self.pixel_height) or
+                is_opaque != (surface.get_flags() & pygame.SRCALPHA == 0) or
+                not in_place and len(blits) > blits_per_step):
+                if is_opaque:
+                    surface = Surface((self.pixel_width, self.pixel_height)).convert()
+                else:
+                    surface = Surface((self.pixel_width, self.pixel_height), pygame.SRCALPHA).convert_alpha()
+                Profiler.shared.count("surfaces")
+            surface.fill(self.fill_color)
+            for start in range(0, len(blits), blits_per_step):
+                if start > 0:
+                    yield
+                for tile_type, variation, dest, area in blits[start:start + blits_per_step]:
+                    surface.blit(Tilemap.tile_types[tile_type].variations[variation], dest, area)
+            Profiler.shared.count("blits", len(blits))
+            self.baked_surface = surface
+            self.bake_count += 1
+            #Levels something has zoomed out to are remade straight away, so they never lag behind the baked image
+            self.update_levels(len(self.levels))
+            #If the tiles changed while this was baking it is already out of date
+            self.is_dirty = self.version != version
+
+        def update_levels(self, level_count : int):
+            '''Remakes the first level_count levels from the baked surface, each by halving the one above it.'''
+            self.levels = []
+            surface = self.baked_surface
+            for level in range(level_count):
+                surface = Camera.downsample(surface)
+                self.levels.append(surface)
+
+        def get_level(self, level : int) -> Surface:
+            '''Returns the chunk's image at 1 / 2 ** level of its size. Levels are only made once something zooms
+            out to them, from then on they are kept up to date every time the chunk is baked.'''
+            surface = self.surface
+            if level == 0:
+                return surface
+            if len(self.levels) < level:
+                self.update_levels(level)
+            return self.levels[level - 1]
+
+        def get_memory_usage(self) -> int:
+            return AssetManager.get_surface_bytes(self.baked_surface) + sum(AssetManager.get_surface_bytes(level) for level in self.levels)
+
+        def cancel_bake(self):
+            if self.bake_job != None:
+                self.bake_job.cancel()
+                self.bake_job = None
+
+        def update_drawable(self, camera : Camera, layer : int, x : float, y : float, y_offset : float = 0):
+            '''Keeps the chunk on the camera as a retained drawable, it is only touched if the chunk's image has changed.
+            Zoomed out cameras are handed the chunk's own level to draw, rather than scaling the image themselves.'''
+            surface = self.surface
+            if camera.level > 0:
+                camera.set_scaled(surface, self.get_level(camera.level))
+            if self.drawable == None or self.drawable.camera is not camera:
+                self.drawable = camera.add_retained(layer, surface, x, y, y_offset)
+            elif self.drawable.surface is not surface:
+                self.drawable.set_surface(surface)
+                self.drawable.set_position(x, y)
+                self.drawable.set_y_offset(y_offset)
+            elif self.drawn_bake_count != self.bake_count:
+                #Baked again over the same surface, so the part of the screen it covers has to be redrawn
+                self.drawable.mark_dirty()
+                level = camera.level
+                camera.invalidate(Rect(((self.drawable.x - camera.x) >> level, (self.drawable.y - camera.y) >> level), self.get_level(level).get_size()))
+            self.drawn_bake_count = self.bake_count
+
+        def remove_drawable(self):
+            if self.drawable != None:
+                self.drawable.remove()
+                self.drawable = None
         
+    class Background:
+        '''A cached image of the floors around a camera, larger than its view by a margin on each side. It is scrolled
+        along with the camera, so only strips that come into it and chunks that change are ever redrawn.'''
+        def __init__(self, tilemap : "Tilemap", camera : Camera, margin : int = 64):
+            self.tilemap = tilemap
+            self.camera = camera
+            self.margin = margin
+            self.surface : Surface = Surface((camera.width + margin * 2, camera.height + margin * 2)).convert()
+            Profiler.shared.count("surfaces")
+            #World position of the top-left of the surface
+            self.x : int = camera.x - margin
+            self.y : int = camera.y - margin
+            #World rects that need to be redrawn, starting with all of it
+            self.dirty_rects : List[Rect] = [Rect((self.x, self.y), self.surface.get_size())]
+            self.drawable : Drawable = None
+
+        def invalidate_chunk(self, chunk_pos : Vector2i):
+            chunk_width = self.tilemap.chunk_size * self.tilemap.tile_size
+            half_tile = self.tilemap.tile_size // 2
+            self.dirty_rects.append(Rect(chunk_pos.x * chunk_width + half_tile, chunk_pos.y * chunk_width + half_tile, chunk_width, chunk_width))
+
+        def update(self):
+            '''Scrolls the background to keep the camera's view inside it and redraws anything out of date.'''
+            camera = self.camera
+            width, height = self.surface.get_size()
+            if (camera.x < self.x or camera.y < self.y or 
+                camera.x + camera.width > self.x + width or camera.y + camera.height > self.y + height):
+                #Recentre on the camera, moving what is already drawn and marking the uncovered strips
+                new_x = camera.x - self.margin
+                new_y = camera.y - self.margin
+                shift_x = self.x - new_x
+                shift_y = self.y - new_y
+                self.surface.scroll(shift_x, shift_y)
+                self.x = new_x
+                self.y = new_y
+                if shift_x > 0:
+                    self.dirty_rects.append(Rect(self.x, self.y, shift_x, height))
+                elif shift_x < 0:
+                    self.dirty_rects.append(Rect(self.x + width + shift_x, self.y, -shift_x, height))
+                if shift_y > 0:
+                    self.dirty_rects.append(Rect(self.x, self.y, width, shift_y))
+                elif shift_y < 0:
+                    self.dirty_rects.append(Rect(self.x, self.y + height + shift_y, width, -shift_y))
+
+            bounds = Rect(self.x, self.y, width, height)
+            for rect in Camera.merge_rects(self.dirty_rects):
+                rect = rect.clip(bounds)
+                if rect.width == 0 or rect.height == 0:
+                    continue #Anything outside is drawn as it scrolls in
+                self.repaint(rect)
+                camera.invalidate(rect.move(-camera.x, -camera.y))
+            self.dirty_rects.clear()
+
+            if self.drawable == None or self.drawable.camera is not camera:
+                self.drawable = camera.add_retained(Camera.UNSORTED, self.surface, self.x, self.y)
+            else:
+                self.drawable.set_position(self.x, self.y)
+
+        def repaint(self, rect : Rect):
+            '''Redraws the floor chunks within a world rect onto the background.'''
+            tilemap = self.tilemap
+            chunk_width = tilemap.chunk_size * tilemap.tile_size
+            half_tile = tilemap.tile_size // 2
+            surface_rect = rect.move(-self.x, -self.y)
+            blits = []
+            for x in range((rect.left - half_tile) // chunk_width, (rect.right - 1 - half_tile) // chunk_width + 1):
+                for y in range((rect.top - half_tile) // chunk_width, (rect.bottom - 1 - half_tile) // chunk_width + 1):
+                    chunk = tilemap.floor_chunks.get((x, y))
+                    if chunk == None:
+                        continue
+                    blits.append((chunk.surface, (x * chunk_width + half_tile - self.x, y * chunk_width + half_tile - self.y)))
+            self.surface.set_clip(surface_rect)
+            self.surface.fill(self.camera.background_color, surface_rect)
+            self.surface.blits(blits, doreturn=False)
+            self.surface.set_clip(None)
+            Profiler.shared.count("blits", len(blits))
+
+        def remove(self):
+            if self.drawable != None:
+                self.drawable.remove()
+                self.drawable = None
+
     class Tile:
-        def __init__(self, source_img : Surface, name : str, has_collision : bool):
-            self.variations : List[Surface] = Tilemap.slice_tile_texture(source_img)
+        def __init__(self, source_path : str, name : str, has_collision : bool, height : int):
+            self.source_path = source_path
             self.has_collision = has_collision
             self.name = name
+            self.height = height
+            self.loaded_variations : List[Surface] = None
+            self.loaded_opaque_variations : List[bool] = None
+            self.load_job : Scheduler.Job = None
+
+        @property
+        def variations(self) -> List[Surface]:
+            '''The 16 dual-grid textures of this tile, loaded from its source image on first access.'''
+            if self.loaded_variations == None:
+                if self.load_job != None:
+                    #A job that never started has no finally to clear it
+                    self.load_job.cancel()
+                    self.load_job = None
+                #The variations are copies, so the source image is only held while they are cut out of it
+                source = AssetManager.shared.acquire(self.source_path)
+                image = source.get()
+                if image == None:
+                    source.release()
+                    raise ValueError("Could not load tile texture from path: " + self.source_path)
+                self.loaded_variations = Tilemap.slice_tile_texture(image)
+                source.release()
+            return self.loaded_variations
+
+        @property
+        def opaque_variations(self) -> List[bool]:
+            '''Whether each variation is opaque all over, worked out the first time it is asked for.'''
+            if self.loaded_opaque_variations == None:
+                self.loaded_opaque_variations = [Tilemap.is_surface_opaque(variation) for variation in self.variations]
+            return self.loaded_opaque_variations
+
+        def get_memory_usage(self) -> int:
+            if self.loaded_variations == None:
+                return 0
+            return sum(AssetManager.get_surface_bytes(variation) for variation in self.loaded_variations)
+
+        def preload(self):
+            '''Loads the variations through the scheduler, ahead of them being needed.'''
+            if self.loaded_variations == None and self.load_job == None:
+                self.load_job = Scheduler.shared.add(self.load_steps(), Scheduler.LOAD_PRIORITY)
+
+        def load_steps(self):
+            '''Waits for the asset manager's loader thread to decode the source image, then cuts the variations
+            out of it a row at a time.'''
+            source = AssetManager.shared.acquire(self.source_path)
+            try:
+                while not source.is_ready.is_set():
+                    yield
+                image = source.get()
+                if image == None:
+                    return
+                yield
+                variations : List[Surface] = []
+                yield from Tilemap.slice_tile_steps(image, variations)
+                self.loaded_variations = variations
+            finally:
+                source.release()
+                self.load_job = None
         
         def __str__(self):
             collision_str : str = ", a floor tile."
@@ -56,173 +357,302 @@ class Tilemap:
 
     tile_types : Dict[int, Tile] = {}
 
-    def __init__(self, chunk_size : int = 8, tile_size : int = 16):
-        self.tiles : Dict[Vector2, int] = {}
-        self.floor_chunks : Dict[Vector2,  Tilemap.Chunk] = {}
-        self.wall_chunks : Dict[Vector2, Tilemap.Chunk] = {}
-        self.ceiling_chunks : Dict[Vector2, Tilemap.Chunk] = {}
+    def __init__(self, chunk_size : int = 8, tile_size : int = 16, cache_floors : bool = True):
+        self.tiles : Dict[Vector2i, int] = {}
+        self.floor_chunks : Dict[Vector2i,  Tilemap.Chunk] = {}
+        self.wall_chunks : Dict[Vector2i, Tilemap.Chunk] = {}
+        self.ceiling_chunks : Dict[Vector2i, Tilemap.Chunk] = {}
+        #Solid tiles merged into as few rects as possible for collisions, in pixels, kept per chunk_size by chunk_size chunk
+        self.collision_rects : Dict[Vector2i, List[Rect]] = {}
         self.chunk_size = chunk_size
         self.tile_size = tile_size
+        #Floors are drawn through a Background when cache_floors is set, rather than a drawable per chunk
+        self.cache_floors = cache_floors
+        self.background : Tilemap.Background = None
+        #Chunks with a drawable on the camera, the ones drawn last frame
+        self.drawn_chunks : Set[Tilemap.Chunk] = set()
+        #Every tile that changes is written to the journal if one is attached, so edits can be saved as they are made
+        self.journal : "TileJournal" = None
 
         if len(Tilemap.tile_types) == 0:
             Tilemap.load_tile_types(tile_size)
     
     def tile_to_world(self, tile_pos : Vector2) -> Vector2:
         '''Returns the world position of the top-left of the tile at a given tile position.'''
-        return tile_pos * self.tile_size
+        return Vector2(tile_pos.x * self.tile_size, tile_pos.y * self.tile_size)
     
-    def world_to_tile(self, world_pos : Vector2) -> Vector2:
+    def world_to_tile(self, world_pos : Vector2) -> Vector2i:
         '''Returns the tile position of the tile containing a given world position.'''
-        tile_pos = Vector2(world_pos.x // self.tile_size, world_pos.y // self.tile_size)
-        return tile_pos
+        return Vector2i(math.floor(world_pos.x / self.tile_size), math.floor(world_pos.y / self.tile_size))
 
-    def get_tile(self, tile_pos : Vector2) -> int:
+    def get_tile(self, tile_pos : Vector2i) -> int:
         '''Returns the id of the tile at a given tile position, -1 Corresponds to an empty tile.'''
-        if tile_pos not in self.tiles:
-            return -1
-        return self.tiles[tile_pos]
+        return self.tiles.get(tile_pos, -1)
     
-    def get_tile_type(self, tile_pos : Vector2) -> Tile:
+    def get_tile_type(self, tile_pos : Vector2i) -> Tile:
         '''Returns the tile data of the tile at a given tile position, returns None if no tile exists there.'''
-        id:int = self.get_tile(tile_pos)
+        id:int = self.tiles.get(tile_pos, -1)
         if id == -1:
             return None
         return Tilemap.tile_types[id]
 
-    def set_tile(self, tile_pos : Vector2, id : int):
+    def set_tile(self, tile_pos : Vector2i, id : int):
         '''Sets the tile at the given tile position to the new tile type indicated by id, use -1 to remove tiles.'''
-        #Set the tile
-        self.tiles[tile_pos] = id
-        tile_type = Tilemap.tile_types[id]
-
-        chunks : Set[Vector2] = set()
-
-        #Floor tiles (chunks are chunk_size by chunk_size tiles)
-        chunks = {Vector2((tile_pos.x - 1)// self.chunk_size, tile_pos.y - 1), 
-                  Vector2(tile_pos.x // self.chunk_size, tile_pos.y - 1),
-                  Vector2((tile_pos.x + 1)// self.chunk_size, tile_pos.y - 1),
-                  Vector2((tile_pos.x - 1)// self.chunk_size, tile_pos.y), 
-                  Vector2(tile_pos.x // self.chunk_size, tile_pos.y),
-                  Vector2((tile_pos.x + 1)// self.chunk_size, tile_pos.y),
-                  Vector2((tile_pos.x - 1)// self.chunk_size, tile_pos.y + 1), 
-                  Vector2(tile_pos.x // self.chunk_size, tile_pos.y + 1),
-                  Vector2((tile_pos.x + 1)// self.chunk_size, tile_pos.y + 1)}
-
-        #Update all adjacent chunk images the tile belongs to
+        self.set_tiles({(math.floor(tile_pos.x), math.floor(tile_pos.y)) : id})
+
+    def set_tiles(self, tiles : Dict[Tuple[int, int], int]):
+        '''Sets every tile position in tiles to its id, use -1 to remove tiles. Each chunk the tiles touch is only
+        rebuilt once, however many of its tiles changed.'''
+        #Chunks next to the tiles, and the chunks the tiles would be the first in along with the height of the first wall in them
+        wall_chunks : Set[Vector2i] = set()
+        new_wall_chunks : Dict[Vector2i, int] = {}
+        floor_chunks : Set[Vector2i] = set()
+        new_floor_chunks : Set[Vector2i] = set()
+        #Chunks where a tile went from solid to not or the other way around
+        collision_chunks : Set[Vector2i] = set()
+        tile_types = Tilemap.tile_types
+        for (tile_x, tile_y), id in tiles.items():
+            #Set the tile
+            tile_pos = Vector2i(tile_x, tile_y)
+            old_id = self.tiles.get(tile_pos, -1)
+            if self.journal != None and old_id != id:
+                self.journal.record(tile_x, tile_y, id)
+            if (old_id != -1 and tile_types[old_id].has_collision) != (id != -1 and tile_types[id].has_collision):
+                collision_chunks.add(Vector2i(tile_x // self.chunk_size, tile_y // self.chunk_size))
+            if id == -1:
+                self.tiles.pop(tile_pos, None)
+            else:
+                self.tiles[tile_pos] = id
+                #Start decoding the tile's texture now, it is usually drawn a frame or more after being placed
+                Tilemap.tile_types[id].preload()
+
+            #Wall tiles (chunks are chunk_size by 1 tiles)
+            wall_chunks.update((Vector2i((tile_x - 1)// self.chunk_size, tile_y - 1), 
+                                Vector2i(tile_x // self.chunk_size, tile_y - 1),
+                                Vector2i((tile_x + 1)// self.chunk_size, tile_y - 1),
+                                Vector2i((tile_x - 1)// self.chunk_size, tile_y), 
+                                Vector2i(tile_x // self.chunk_size, tile_y),
+                                Vector2i((tile_x + 1)// self.chunk_size, tile_y),
+                                Vector2i((tile_x - 1)// self.chunk_size, tile_y + 1), 
+                                Vector2i(tile_x // self.chunk_size, tile_y + 1),
+                                Vector2i((tile_x + 1)// self.chunk_size, tile_y + 1)))
+
+            #Floor tiles (chunks are chunk_size by chunk_size tiles)
+            chunks = (Vector2i(tile_x // self.chunk_size, tile_y // self.chunk_size), 
+                      Vector2i((tile_x - 1)// self.chunk_size, tile_y // self.chunk_size),
+                      Vector2i(tile_x // self.chunk_size, (tile_y - 1) // self.chunk_size),
+                      Vector2i((tile_x - 1)// self.chunk_size, (tile_y - 1) // self.chunk_size))
+            floor_chunks.update(chunks)
+            if id != -1:
+                #Removing a tile never needs a new chunk, a tile only needs the wall chunk of its own row
+                new_wall_chunks.setdefault(Vector2i(tile_x // self.chunk_size, tile_y), Tilemap.tile_types[id].height)
+                new_floor_chunks.update(chunks)
+
+        #Update all adjacent chunk images the tiles belong to
         #Wall chunks
-        for chunk_pos in chunks:
+        for chunk_pos in wall_chunks:
             if chunk_pos not in self.wall_chunks:
-                if id == -1:
-                    continue #We were removing a tile that was in an ungenerated chunk. No action needed.
-                if chunk_pos != Vector2(tile_pos.x // self.chunk_size, tile_pos.y):
+                if chunk_pos not in new_wall_chunks:
                     continue #The chunk doesn't need to be updated
                 #Otherwise, generate a new chunk
-                self.wall_chunks[chunk_pos] = Tilemap.Chunk(self.chunk_size, 1, self.tile_size, tile_type.variations[0].get_height())
+                self.wall_chunks[chunk_pos] = Tilemap.Chunk(self.chunk_size, 1, self.tile_size, new_wall_chunks[chunk_pos])
             #Update the chunks' images
             self.update_wall_chunk(chunk_pos, self.wall_chunks[chunk_pos])
 
             #Check to see if the chunk still has any tiles in it, if not, remove it
             if self.wall_chunks[chunk_pos].is_empty:
-                self.wall_chunks.pop(chunk_pos)
+                chunk = self.wall_chunks.pop(chunk_pos)
+                chunk.remove_drawable()
+                chunk.cancel_bake()
+            else:
+                self.schedule_bake(chunk_pos, self.wall_chunks[chunk_pos], False)
 
-        chunks = {Vector2(tile_pos.x // self.chunk_size, tile_pos.y // self.chunk_size), 
-                  Vector2((tile_pos.x - 1)// self.chunk_size, tile_pos.y // self.chunk_size),
-                  Vector2(tile_pos.x // self.chunk_size, (tile_pos.y - 1) // self.chunk_size),
-                  Vector2((tile_pos.x - 1)// self.chunk_size, (tile_pos.y - 1) // self.chunk_size)}
-
-        #Floor tiles
-        for chunk_pos in chunks:
+        #Floor chunks
+        for chunk_pos in floor_chunks:
             if chunk_pos not in self.floor_chunks:
-                if id == -1:
+                if chunk_pos not in new_floor_chunks:
                     continue #We were removing a tile that was in an ungenerated chunk. No action needed.
                 #Otherwise, generate a new chunk
                 self.floor_chunks[chunk_pos] = Tilemap.Chunk(self.chunk_size, self.chunk_size, self.tile_size, self.tile_size)
             #Update the chunks' images
             self.update_chunk(chunk_pos, self.floor_chunks[chunk_pos])
+            if self.background != None:
+                self.background.invalidate_chunk(chunk_pos)
 
             #Check to see if the chunk still has any tiles in it, if not, remove it
             if self.floor_chunks[chunk_pos].is_empty:
-                self.floor_chunks.pop(chunk_pos)
+                chunk = self.floor_chunks.pop(chunk_pos)
+                chunk.remove_drawable()
+                chunk.cancel_bake()
+            else:
+                self.schedule_bake(chunk_pos, self.floor_chunks[chunk_pos], True)
 
-    def update_wall_chunk(self, chunk_pos : Vector2, chunk : Chunk):
-        #Find the correct size for the chunk
-        max_height = chunk.surface.get_height()
-        for vert_y in range(chunk_pos.y * chunk.height, (chunk_pos.y + 1) * chunk.height):
-            for vert_x in range(chunk_pos.x * chunk.width - 1, (chunk_pos.x + 1) * chunk.width + 1):
-                tile_type = self.get_tile_type(Vector2(vert_x, vert_y))
-                if tile_type == None:
-                    continue
-                height = tile_type.variations[0].get_height()
-                if height > max_height:
-                    max_height = height
-        chunk.surface = Surface((chunk.surface.get_width(), max_height), pygame.SRCALPHA).convert_alpha()
-        #chunk.surface.fill((255 * (1 - chunk_pos.y % 2), 0, 255 * (chunk_pos.y % 2), 100))
+        for chunk_pos in collision_chunks:
+            self.update_collision_chunk(chunk_pos)
+
+    def schedule_bake(self, chunk_pos : Vector2i, chunk : Chunk, is_floor : bool):
+        '''Rebakes a chunk that has changed through the scheduler, it keeps showing its old image until that is done.
+        Chunks that have never been baked are left to bake when they are first drawn.'''
+        if chunk.baked_surface == None or chunk.bake_job != None:
+            return
+        chunk.bake_job = Scheduler.shared.add(self.bake_task(chunk_pos, chunk, is_floor), Scheduler.BAKE_PRIORITY)
+
+    def bake_task(self, chunk_pos : Vector2i, chunk : Chunk, is_floor : bool):
+        try:
+            #Edits made while it was baking mean going around again
+            while chunk.is_dirty:
+                yield from chunk.bake_steps()
+            #Floors are drawn through the background, which has to be told the chunk's new image is ready
+            if is_floor and self.background != None:
+                self.background.invalidate_chunk(chunk_pos)
+        finally:
+            chunk.bake_job = None
+
+    def update_wall_chunk(self, chunk_pos : Vector2i, chunk : Chunk):
+        Profiler.shared.count("chunk_rebuilds")
+        #Read the ids of the chunk's row and the rows above and below it once, one column of padding on each side.
+        #Plain tuples are used as keys here since they hash and compare the same as Vector2i without the overhead.
+        tiles = self.tiles
+        base_x = chunk_pos.x * chunk.width
+        row_length = chunk.width + 2
+        ids = [tiles.get((x, y), -1) for y in range(chunk_pos.y - 1, chunk_pos.y + 2)
+                                     for x in range(base_x - 1, base_x + chunk.width + 1)]
 
-        chunk.is_empty = True
+        #Find the correct size for the chunk
+        max_height = chunk.pixel_height
+        for id in ids[row_length:row_length * 2]:
+            if id == -1:
+                continue
+            height = Tilemap.tile_types[id].height
+            if height > max_height:
+                max_height = height
+        chunk.pixel_height = max_height
+        chunk.clear()
         
         for x in range(chunk.width):
-            tile_type = self.get_tile(Vector2(chunk_pos.x * self.chunk_size + x, chunk_pos.y))
+            #Index of this tile in ids
+            center = row_length + x + 1
+            tile_type = ids[center]
             if tile_type == -1 or not Tilemap.tile_types[tile_type].has_collision:
                 continue
-            tile_surface : Surface = Surface(Tilemap.tile_types[tile_type].variations[0].get_size(), pygame.SRCALPHA).convert_alpha()
-            surf_altered = False
+            tile_height = Tilemap.tile_types[tile_type].height
+            #Each wall tile sits at the bottom of the chunk, in its own tile wide column
+            column_x = x * self.tile_size
+            column_y = chunk.pixel_height - tile_height
             #For each vertex of chunk
             for vert_y in range(2):
                 for vert_x in range(2):
                     tile_bitmap : int = 0x0
                     #Build the tile image based on the neighboring tiles
+                    topleft = center + (vert_y - 1) * row_length + vert_x - 1
                     #Topleft Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(vert_x + x - 1, vert_y - 1)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft] == tile_type:
                         tile_bitmap |= 0x1
 
                     #Topright Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(vert_x + x, vert_y - 1)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft + 1] == tile_type:
                         tile_bitmap |= 0x2
 
                     #Bottomleft Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(vert_x + x - 1, vert_y)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft + row_length] == tile_type:
                         tile_bitmap |= 0x4
                     
                     #Bottomright Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(vert_x + x, vert_y)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft + row_length + 1] == tile_type:
                         tile_bitmap |= 0x8
 
                     if tile_bitmap == 0:
                         continue
-                    surf_altered = surf_altered or True
-                    tile_texture = Tilemap.tile_types[tile_type].variations[Tilemap.TILE_BITMAPS[tile_bitmap]]
-                    tile_surface.blit(tile_texture, ((vert_x - 0.5) * self.tile_size, (vert_y - 0.5) * self.tile_size))
-            if surf_altered:
-                chunk.is_empty = chunk.is_empty and False
-                chunk.surface.blit(tile_surface, (x * self.tile_size, chunk.surface.get_height() - tile_texture.get_height()))
-
-    def update_chunk(self, chunk_pos : Vector2, chunk : Chunk, is_wall = False):
+                    #Clip the texture to the tile's column, it is offset by half a tile towards this vertex
+                    offset_x = vert_x * self.tile_size - self.tile_size // 2
+                    offset_y = vert_y * self.tile_size - self.tile_size // 2
+                    left = max(offset_x, 0)
+                    top = max(offset_y, 0)
+                    right = min(offset_x + self.tile_size, self.tile_size)
+                    bottom = min(offset_y + tile_height, tile_height)
+                    area = Rect(left - offset_x, top - offset_y, right - left, bottom - top)
+                    chunk.add_blit(tile_type, Tilemap.TILE_BITMAPS[tile_bitmap], (column_x + left, column_y + top), area)
+
+    def update_collision_chunk(self, chunk_pos : Vector2i):
+        '''Covers the solid tiles of a chunk with rects, found greedily: each run of solid tiles along a row is
+        made as long as it can be, then grown down for as long as the rows below are solid all along it.'''
+        Profiler.shared.count("collision_rebuilds")
+        size = self.chunk_size
+        tile_size = self.tile_size
+        base_x = chunk_pos.x * size
+        base_y = chunk_pos.y * size
+        tiles = self.tiles
+        tile_types = Tilemap.tile_types
+        ids = [[tiles.get((x, y), -1) for x in range(base_x, base_x + size)] for y in range(base_y, base_y + size)]
+        #Tiles are marked as not solid once a rect covers them
+        solid = [[id != -1 and tile_types[id].has_collision for id in row] for row in ids]
+        rects : List[Rect] = []
+        for top in range(size):
+            row = solid[top]
+            left = 0
+            while left < size:
+                if not row[left]:
+                    left += 1
+                    continue
+                right = left
+                while right < size and row[right]:
+                    right += 1
+                bottom = top + 1
+                while bottom < size and all(solid[bottom][left:right]):
+                    bottom += 1
+                for y in range(top, bottom):
+                    solid[y][left:right] = [False] * (right - left)
+                rects.append(Rect((base_x + left) * tile_size, (base_y + top) * tile_size,
+                                  (right - left) * tile_size, (bottom - top) * tile_size))
+                left = right
+        if len(rects) > 0:
+            self.collision_rects[chunk_pos] = rects
+        else:
+            self.collision_rects.pop(chunk_pos, None)
+
+    def get_collision_rects(self, left : int, top : int, right : int, bottom : int) -> List[Rect]:
+        '''Returns the merged rects of solid tiles that overlap the tiles between two tile positions (inclusive).'''
+        tile_size = self.tile_size
+        bounds = Rect(left * tile_size, top * tile_size, (right - left + 1) * tile_size, (bottom - top + 1) * tile_size)
+        result : List[Rect] = []
+        for chunk_x in range(left // self.chunk_size, right // self.chunk_size + 1):
+            for chunk_y in range(top // self.chunk_size, bottom // self.chunk_size + 1):
+                #Plain tuples hash and compare the same as Vector2i
+                rects = self.collision_rects.get((chunk_x, chunk_y))
+                if rects == None:
+                    continue
+                for index in bounds.collidelistall(rects):
+                    result.append(rects[index])
+        return result
+
+    def update_chunk(self, chunk_pos : Vector2i, chunk : Chunk, is_wall = False):
+        Profiler.shared.count("chunk_rebuilds")
+        #Read the ids of every tile touching the chunk once, this includes one extra row and column
+        tiles = self.tiles
+        base_x = chunk_pos.x * chunk.width
+        base_y = chunk_pos.y * chunk.height
+        row_length = chunk.width + 1
+        ids = [tiles.get((x, y), -1) for y in range(base_y, base_y + chunk.height + 1)
+                                     for x in range(base_x, base_x + row_length)]
+        present_ids = set(ids)
+
         #Determine the new height of the chunk
+        chunk.clear()
         if is_wall:
-            max_height = chunk.surface.get_height()
-            for y in range(chunk_pos.y * chunk.height, (chunk_pos.y + 1) * chunk.height):
-                for x in range(chunk_pos.x * chunk.width - 1, (chunk_pos.x + 1) * chunk.width + 1):
-                    tile_type = self.get_tile_type(Vector2(x, y))
+            max_height = chunk.pixel_height
+            for y in range(base_y, base_y + chunk.height):
+                for x in range(base_x - 1, base_x + chunk.width + 1):
+                    tile_type = self.get_tile_type((x, y))
                     if tile_type == None:
                         continue
-                    height = tile_type.variations[0].get_height()
-                    if height > max_height:
-                        max_height = height
-            chunk.surface = Surface((chunk.surface.get_width(), max_height), pygame.SRCALPHA).convert_alpha()
-            chunk.surface.fill((255 * (1 - chunk_pos.y % 2), 0, 255 * (chunk_pos.y % 2), 100))
-        else:
-            chunk.surface.fill((0, 0, 0, 0))
+                    if tile_type.height > max_height:
+                        max_height = tile_type.height
+            chunk.pixel_height = max_height
+            chunk.fill_color = (255 * (1 - chunk_pos.y % 2), 0, 255 * (chunk_pos.y % 2), 100)
         
-        chunk.is_empty = True
         for tile_type in range(len(Tilemap.tile_types)):
+            if tile_type not in present_ids:
+                continue
             if (is_wall and not Tilemap.tile_types[tile_type].has_collision or 
                 not is_wall and Tilemap.tile_types[tile_type].has_collision):
                 continue
@@ -230,62 +660,93 @@ class Tilemap:
             for y in range(chunk.height):
                 for x in range(chunk.width):
                     tile_bitmap : int = 0x0
+                    topleft = y * row_length + x
                     #Topleft Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(x, y)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft] == tile_type:
                         tile_bitmap |= 0x1
 
                     #Topright Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(x + 1, y)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft + 1] == tile_type:
                         tile_bitmap |= 0x2
 
                     #Bottomleft Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(x, y + 1)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft + row_length] == tile_type:
                         tile_bitmap |= 0x4
                     
                     #Bottomright Tile
-                    tile_pos = Vector2(chunk_pos.x * chunk.width, chunk_pos.y * chunk.height) + Vector2(x + 1, y + 1)
-                    tile = self.get_tile(tile_pos)
-                    if tile == tile_type:
+                    if ids[topleft + row_length + 1] == tile_type:
                         tile_bitmap |= 0x8
 
                     if tile_bitmap == 0:
                         continue
-                    chunk.is_empty = chunk.is_empty and False
-                    tile_surface = Tilemap.tile_types[tile_type].variations[Tilemap.TILE_BITMAPS[tile_bitmap]]
                     if is_wall:
-                        chunk.surface.blit(tile_surface, (x * self.tile_size, y * self.tile_size + chunk.surface.get_height() - tile_surface.get_height()))
+                        dest = (x * self.tile_size, y * self.tile_size + chunk.pixel_height - Tilemap.tile_types[tile_type].height)
                     else:
-                        chunk.surface.blit(tile_surface, (x * self.tile_size, y * self.tile_size))
+                        dest = (x * self.tile_size, y * self.tile_size)
+                    chunk.add_blit(tile_type, Tilemap.TILE_BITMAPS[tile_bitmap], dest)
+
+    def get_memory_usage(self) -> Dict[str, int]:
+        '''Returns the bytes of pixel data held by the baked chunks, the floor background and the tile textures.'''
+        return {"floor_chunks" : sum(chunk.get_memory_usage() for chunk in self.floor_chunks.values()),
+                "wall_chunks" : sum(chunk.get_memory_usage() for chunk in self.wall_chunks.values()),
+                "ceiling_chunks" : sum(chunk.get_memory_usage() for chunk in self.ceiling_chunks.values()),
+                "background" : AssetManager.get_surface_bytes(self.background.surface) if self.background != None else 0,
+                "tile_variations" : sum(tile_type.get_memory_usage() for tile_type in Tilemap.tile_types.values())}
 
     def draw(self, camera : Camera):
-        camera_tile = self.world_to_tile(Vector2(camera.x, camera.y))
-        camera_chunk_x = camera_tile.x // self.chunk_size
-        camera_chunk_y = camera_tile.y // self.chunk_size
-        for x in range(-1 + camera_chunk_x, 7 + camera_chunk_x):
-            for y in range(-1 + camera_chunk_y, 4 + camera_chunk_y):
-                tile_pos = Vector2(x * self.chunk_size, y * self.chunk_size)
-                chunk_pos = Vector2(x, y)
-                #Draw the floors
-                if chunk_pos not in self.floor_chunks:
-                    continue
-                position = self.tile_to_world(tile_pos + Vector2(0.5, 0.5))
-                camera.add_to_unsorted(self.floor_chunks[chunk_pos].surface, position.x, position.y)
+        '''Puts the chunks in view on the camera. They stay there as retained drawables, so chunks that
+        have not changed since the last frame cost nothing here beyond a lookup. Floors are drawn
+        through the background if cache_floors is set, unless the camera is zoomed out, then every
+        chunk is drawn from its own scaled down level. Chunks that are no longer drawn are taken off the
+        camera, so the camera only ever has the chunks around its view to cull.'''
+        drawn : Set[Tilemap.Chunk] = set()
+        chunk_width = self.chunk_size * self.tile_size
+        #The chunks in view with a chunk of margin, the walls of chunks below the view can be tall enough to reach into it
+        left = camera.x // chunk_width - 1
+        top = camera.y // chunk_width - 1
+        right = (camera.x + camera.view_width) // chunk_width + 2
+        bottom = (camera.y + camera.view_height) // chunk_width + 2
+        half_tile = self.tile_size * 0.5
+        if self.cache_floors and camera.level == 0:
+            #The floors are all a single drawable
+            if self.background == None or self.background.camera is not camera:
+                if self.background != None:
+                    self.background.remove()
+                self.background = Tilemap.Background(self, camera)
+            self.background.update()
+        else:
+            #The background only covers the camera's view at full size
+            if self.background != None:
+                self.background.remove()
+            for x in range(left, right):
+                for y in range(top, bottom):
+                    #Draw the floors
+                    chunk = self.floor_chunks.get((x, y))
+                    if chunk == None:
+                        continue
+                    draw_x = x * chunk_width + half_tile
+                    draw_y = y * chunk_width + half_tile
+                    #Cull before touching the surface so chunks out of view are never baked
+                    if not camera.is_rect_visible(draw_x, draw_y, chunk.pixel_width, chunk.pixel_height):
+                        continue
+                    chunk.update_drawable(camera, Camera.UNSORTED, draw_x, draw_y)
+                    drawn.add(chunk)
 
-        for x in range(-1 + camera_chunk_x, 7 + camera_chunk_x):
-            for y in range(-1 + camera_chunk_y, 4 + camera_chunk_y):
-                tile_pos = Vector2(x * self.chunk_size, y * self.chunk_size)
-                chunk_pos = Vector2(x, y)
+        for x in range(left, right):
+            for y in range(top, bottom):
                 #Draw the walls
-                for row in range(0, self.chunk_size):
-                    if Vector2(chunk_pos.x, tile_pos.y + row) not in self.wall_chunks:
+                for row in range(y * self.chunk_size, (y + 1) * self.chunk_size):
+                    chunk = self.wall_chunks.get((x, row))
+                    if chunk == None:
+                        continue
+                    draw_x = x * chunk_width
+                    draw_y = row * self.tile_size - (chunk.pixel_height - self.tile_size)
+                    if not camera.is_rect_visible(draw_x, draw_y, chunk.pixel_width, chunk.pixel_height):
                         continue
-                    chunk_surface = self.wall_chunks[Vector2(chunk_pos.x, tile_pos.y + row)].surface
-                    draw_position = self.tile_to_world(tile_pos + Vector2(0, row))
-                    draw_position.y -= (chunk_surface.get_height() - self.tile_size)
-                    camera.add_to_sorted(chunk_surface, draw_position.x, draw_position.y, chunk_surface.get_height())
\ No newline at end of file
+                    chunk.update_drawable(camera, Camera.SORTED, draw_x, draw_y, chunk.pixel_height)
+                    drawn.add(chunk)
+
+        #Anything drawn last frame but not this one has gone out of view, or the background has taken its floors back over
+        for chunk in self.drawn_chunks - drawn:
+            chunk.remove_drawable()
+        self.drawn_chunks = drawn
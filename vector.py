@@ -1,16 +1,19 @@
 import math
+from typing import NamedTuple
 
 class Vector2:
+    __slots__ = ("x", "y")
+
     def __init__(self, x : float, y : float):
         self.x = x
         self.y = y
-    
+
     def __add__(self, obj : "Vector2"):
         return Vector2(self.x + obj.x, self.y + obj.y)
 
     def __sub__(self, obj : "Vector2"):
         return Vector2(self.x - obj.x, self.y - obj.y)
-    
+
     def __mul__(self, obj : float):
         return Vector2(self.x * obj, self.y * obj)
 
@@ -19,22 +22,28 @@ class Vector2:
 
     def __truediv__(self, obj : float):
         return Vector2(self.x / obj, self.y / obj)
-    
+
+    #The in-place operators modify this vector rather than allocating a new one
     def __iadd__(self, obj : "Vector2"):
-        return Vector2(self.x + obj.x, self.y + obj.y)
+        self.x += obj.x
+        self.y += obj.y
+        return self
 
     def __isub__(self, obj : "Vector2"):
-        return Vector2(self.x - obj.x, self.y - obj.y)
-    
+        self.x -= obj.x
+        self.y -= obj.y
+        return self
+
     def __imul__(self, obj : float):
-        return Vector2(self.x * obj, self.y * obj)
+        self.x *= obj
+        self.y *= obj
+        return self
 
-    def __rimul__(self, obj : float):
-        return Vector2(self.x * obj, self.y * obj)
+    def __itruediv__(self, obj : float):
+        self.x /= obj
+        self.y /= obj
+        return self
 
-    def __idiv__(self, obj : float):
-        return Vector2(self.x / obj, self.y / obj)
-    
     def __eq__(self, obj: "Vector2") -> bool:
         return self.x == obj.x and self.y == obj.y
 
@@ -44,6 +53,15 @@ class Vector2:
     def __str__(self):
         return "(" + str(self.x) + ", " + str(self.y) + ")"
 
+    def set(self, x : float, y : float) -> "Vector2":
+        '''Sets both components in place and returns this vector.'''
+        self.x = x
+        self.y = y
+        return self
+
+    def copy(self) -> "Vector2":
+        return Vector2(self.x, self.y)
+
     def length(self):
         return math.sqrt(self.x * self.x + self.y * self.y)
 
@@ -54,23 +72,22 @@ class Vector2:
         return self / length
 
     def corrected(self) -> "Vector2":
+        return self.copy().correct()
+
+    def correct(self) -> "Vector2":
+        '''Snaps components within a small delta of a whole number onto it, in place, and returns this vector.'''
         min_delta = 0.0001
-        corrected_vector = Vector2(0, 0)
         #x component
         rounded_x = round(self.x)
         if abs(rounded_x - self.x) < min_delta:
-            corrected_vector.x = rounded_x
-        else:
-            corrected_vector.x = self.x
-        
+            self.x = rounded_x
+
         #y component
         rounded_y = round(self.y)
         if abs(rounded_y - self.y) < min_delta:
-            corrected_vector.y = rounded_y
-        else:
-            corrected_vector.y = self.y
-    
-        return corrected_vector
+            self.y = rounded_y
+
+        return self
 
     def VectorTo(origin : "Vector2", target : "Vector2", maginude = 1.0):
         return (target - origin).normalized() * maginude
@@ -84,76 +101,39 @@ class Vector2:
     def from_tuple(tuple : tuple):
         return Vector2(tuple[0], tuple[1])
 
-class Vector2i:
-    def __init__(self, x : int, y : int):
-        self.x = x
-        self.y = y
-    
+class Vector2i(NamedTuple):
+    '''An immutable integer vector, used as the key for tiles and chunks. It is a tuple, so it hashes
+    cheaply and compares equal to a plain (x, y) tuple, which hot loops may use for lookups instead.'''
+    x : int
+    y : int
+
     def __add__(self, obj : "Vector2i"):
         return Vector2i(self.x + obj.x, self.y + obj.y)
 
     def __sub__(self, obj : "Vector2i"):
         return Vector2i(self.x - obj.x, self.y - obj.y)
 
-    def __add__(self, obj : "Vector2"):
-        return Vector2(self.x + obj.x, self.y + obj.y)
-
-    def __sub__(self, obj : "Vector2"):
-        return Vector2(self.x - obj.x, self.y - obj.y)
-    
-    def __mul__(self, obj : float):
-        return Vector2i(self.x * obj, self.y * obj)
-
-    def __rmul__(self, obj : float):
-        return Vector2i(self.x * obj, self.y * obj)
-
-    def __truediv__(self, obj : float):
-        return Vector2i(self.x / obj, self.y / obj)
-    
-    def __iadd__(self, obj : "Vector2i"):
-        return Vector2i(self.x + obj.x, self.y + obj.y)
-
-    def __isub__(self, obj : "Vector2i"):
-        return Vector2i(self.x - obj.x, self.y - obj.y)
-    
-    def __iadd__(self, obj : "Vector2"):
-        return Vector2(self.x + obj.x, self.y + obj.y)
-
-    def __isub__(self, obj : "Vector2"):
-        return Vector2(self.x - obj.x, self.y - obj.y)
-    
-    def __imul__(self, obj : float):
+    def __mul__(self, obj : int):
         return Vector2i(self.x * obj, self.y * obj)
 
-    def __rimul__(self, obj : float):
+    def __rmul__(self, obj : int):
         return Vector2i(self.x * obj, self.y * obj)
 
-    def __idiv__(self, obj : float):
-        return Vector2i(self.x / obj, self.y / obj)
-    
-    def __eq__(self, obj: "Vector2i") -> bool:
-        return self.x == obj.x and self.y == obj.y
-    
-    def __eq__(self, obj: "Vector2") -> bool:
-        return self.x == int(obj.x) and self.y == int(obj.y)
-
-    def __hash__(self) -> int:
-        return hash((self.x, self.y))
-
     def __str__(self):
         return "(" + str(self.x) + ", " + str(self.y) + ")"
 
     def length(self):
         return math.sqrt(self.x * self.x + self.y * self.y)
 
-    def normalized(self):
-        length = self.length()
-        if (length == 0):
-            return Vector2i(0, 0)
-        return self / length
+    def to_vector2(self) -> Vector2:
+        return Vector2(self.x, self.y)
 
     def to_tuple(self):
         return (self.x, self.y)
 
     def from_tuple(tuple : tuple):
-        return Vector2(tuple[0], tuple[1])
\ No newline at end of file
+        return Vector2i(tuple[0], tuple[1])
+
+    def floored(vector : Vector2) -> "Vector2i":
+        '''Returns the integer vector of the cell containing a given vector.'''
+        return Vector2i(math.floor(vector.x), math.floor(vector.y))